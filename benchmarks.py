@@ -0,0 +1,212 @@
+'''
+Benchmarks for the scheduler hot paths and a full simulated day.
+
+Times makedict, find_orders, route_distance, shortest_path, batch
+schedule_flights and simulate for every scheduler class over synthetic
+hospitals, queue depths and fleet sizes. Results are written as JSON and
+compared against a stored baseline:
+
+    python benchmarks.py --output bench.json --save-baseline
+    python benchmarks.py --baseline bench_baseline.json
+
+Exits non-zero if any benchmark is slower than baseline * (1 + tolerance),
+or if the baseline passed with --baseline doesn't exist.
+
+'''
+import sys
+import json
+import time
+import argparse
+import pandas as pd
+from zipline import ZipScheduler
+from schedulers import ZipScheduler_NextOrd, ZipScheduler_Greedy, ZipScheduler_SP
+from simulation import simulate
+from workload import generate_hospitals, generate_orders, HOUR
+
+SCHEDULERS = [ZipScheduler, ZipScheduler_NextOrd, ZipScheduler_Greedy, ZipScheduler_SP]
+
+HOSPITAL_COUNTS = [20, 200, 2000]
+QUEUE_DEPTHS = [10, 1000, 100000]
+FLEET_SIZES = [10, 100, 1000]
+
+QUICK_HOSPITAL_COUNTS = [20, 200]
+QUICK_QUEUE_DEPTHS = [10, 1000]
+QUICK_FLEET_SIZES = [10, 100]
+
+DEFAULT_BASELINE = "bench_baseline.json"
+
+
+def synthetic_hospitals(n, seed=0):
+    return generate_hospitals(n, seed=seed)
+
+
+def synthetic_orders(hosp_df, n, start_time=25640, end_time=71840, seed=0):
+    # n orders spread evenly over the window, via the workload generator
+    rate = n*HOUR/(end_time - start_time)
+    orders = generate_orders(hosp_df, days=1, seed=seed, hourly_rates=[rate]*24)
+    return pd.DataFrame([o for o in orders if start_time <= o.received_time < end_time])
+
+
+def timeit(fn, repeat=3):
+    # best of repeat, fn does its own setup and returns the seconds to count
+    return min(fn() for _ in range(repeat))
+
+
+def bench_makedict(n_hosp, repeat):
+    hosp_df = synthetic_hospitals(n_hosp)
+    zs = ZipScheduler(hosp_df)
+
+    def run():
+        start = time.perf_counter()
+        zs.makedict(hosp_df)
+        return time.perf_counter() - start
+    return timeit(run, repeat)
+
+
+def bench_find_orders(cls, depth, repeat):
+    hosp_df = synthetic_hospitals(200)
+    orders_df = synthetic_orders(hosp_df, depth)
+
+    def run():
+        zs = cls(hosp_df)
+        for order in orders_df.itertuples(index=False):
+            zs.queue_order(order.received_time, order.hospital_name, order.priority)
+        start = time.perf_counter()
+        zs.find_orders()
+        return time.perf_counter() - start
+    return timeit(run, repeat)
+
+
+def bench_route_distance(n_hosp, repeat, calls=10000):
+    hosp_df = synthetic_hospitals(n_hosp)
+    zs = ZipScheduler(hosp_df)
+    names = hosp_df["hospital_name"][:3]
+    orders = [{"hospital": name} for name in names]
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(calls):
+            zs.route_distance(*orders)
+        return time.perf_counter() - start
+    return timeit(run, repeat)
+
+
+def bench_shortest_path(load, repeat):
+    hosp_df = synthetic_hospitals(200)
+    names = hosp_df["hospital_name"][:load]
+    orders = [{"hospital": name} for name in names]
+
+    def run():
+        # a fresh scheduler each time so the route cache starts empty
+        zs = ZipScheduler_SP(hosp_df)
+        start = time.perf_counter()
+        zs.shortest_path(*orders)
+        return time.perf_counter() - start
+    return timeit(run, repeat)
+
+
+def bench_schedule_flights(cls, total_zips, repeat, per_zip=3):
+    # a burst of per_zip orders for every idle zip, dispatched in one batch
+    hosp_df = synthetic_hospitals(200)
+    orders_df = synthetic_orders(hosp_df, per_zip*total_zips)
+
+    def run():
+        zs = cls(hosp_df, total_zips=total_zips)
+        for order in orders_df.itertuples(index=False):
+            zs.queue_order(order.received_time, order.hospital_name, order.priority)
+        start = time.perf_counter()
+        zs.schedule_flights(71840)
+        return time.perf_counter() - start
+    return timeit(run, repeat)
+
+
+def bench_day(cls, total_zips, repeat, n_orders=2000):
+    hosp_df = synthetic_hospitals(200)
+    orders_df = synthetic_orders(hosp_df, n_orders)
+
+    def run():
+        zs = cls(hosp_df, total_zips=total_zips)
+        start = time.perf_counter()
+        simulate(zs, orders_df)
+        return time.perf_counter() - start
+    return timeit(run, repeat)
+
+
+def run_benchmarks(quick=False, repeat=3):
+    hospital_counts = QUICK_HOSPITAL_COUNTS if quick else HOSPITAL_COUNTS
+    queue_depths = QUICK_QUEUE_DEPTHS if quick else QUEUE_DEPTHS
+    fleet_sizes = QUICK_FLEET_SIZES if quick else FLEET_SIZES
+
+    results = []
+
+    def record(name, seconds, **params):
+        key = name + "".join("[%s=%s]" % item for item in sorted(params.items()))
+        results.append({"key": key, "name": name, "params": params, "seconds": seconds})
+        print("%-60s %10.6f s" % (key, seconds), file=sys.stderr)
+
+    for n in hospital_counts:
+        record("makedict", bench_makedict(n, repeat), hospitals=n)
+        record("route_distance", bench_route_distance(n, repeat), hospitals=n)
+    for load in [3, 6, 8]:
+        record("shortest_path", bench_shortest_path(load, repeat), load=load)
+    for cls in SCHEDULERS:
+        for depth in queue_depths:
+            record("find_orders", bench_find_orders(cls, depth, repeat),
+                   scheduler=cls.__name__, depth=depth)
+        for zips in fleet_sizes:
+            record("schedule_flights", bench_schedule_flights(cls, zips, repeat),
+                   scheduler=cls.__name__, zips=zips)
+            record("simulate_day", bench_day(cls, zips, repeat),
+                   scheduler=cls.__name__, zips=zips)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # keys slower than baseline * (1 + tolerance)
+    base = {r["key"]: r["seconds"] for r in baseline}
+    return [(r["key"], base[r["key"]], r["seconds"]) for r in results
+            if r["key"] in base and r["seconds"] > base[r["key"]]*(1 + tolerance)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline",
+                        help="baseline JSON to compare against (default %s); "
+                             "missing is an error when given explicitly" % DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown over baseline (0.5 = 50%%)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="smaller inputs only")
+    args = parser.parse_args()
+
+    results = run_benchmarks(quick=args.quick, repeat=args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    baseline_path = args.baseline or DEFAULT_BASELINE
+    if args.save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+        sys.exit(0)
+
+    try:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print("No baseline at %s, nothing to compare" % baseline_path, file=sys.stderr)
+        # a baseline asked for by name must exist, or CI would never fail
+        sys.exit(1 if args.baseline else 0)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for key, before, after in regressions:
+        print("REGRESSION %s: %.6f s -> %.6f s (%.0f%% slower)"
+              % (key, before, after, 100*(after/before - 1)), file=sys.stderr)
+    sys.exit(1 if regressions else 0)
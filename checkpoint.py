@@ -0,0 +1,104 @@
+'''
+Checkpoint and restore of scheduler state.
+
+A snapshot holds the config, hospitals, distance matrix, both order queues
+and every zip's state as plain NumPy arrays, saved with np.savez (no
+pickle), so saving and loading take milliseconds and the distance matrix
+is never rebuilt. A snapshot can be restored as any scheduler class, to
+fork what-if runs from a shared mid-day state:
+
+    save(scheduler, "noon.npz")
+    runs = fork(load_snapshot("noon.npz"), [ZipScheduler_Greedy, ZipScheduler_SP])
+
+'''
+import json
+import numpy as np
+import pandas as pd
+from zipline import ZipScheduler, DistanceMatrix, Fleet, Order, Priority
+from schedulers import ZipScheduler_NextOrd, ZipScheduler_Greedy, ZipScheduler_SP
+
+SCHEDULERS = {cls.__name__: cls for cls in
+              [ZipScheduler, ZipScheduler_NextOrd, ZipScheduler_Greedy, ZipScheduler_SP]}
+
+QUEUES = [("emergency", Priority.EMERGENCY), ("resupply", Priority.RESUPPLY)]
+
+
+def snapshot(scheduler):
+    # the scheduler's state as a dict of arrays
+    snap = {
+        "config": np.array(json.dumps({
+            "scheduler": type(scheduler).__name__,
+            "total_zips": scheduler.total_zips,
+            "max_load": scheduler.max_load,
+            "flight_speed": scheduler.flight_speed,
+            "max_range": scheduler.max_range,
+            "base": scheduler.base_name,
+            "next_order_id": scheduler.next_order_id,
+        })),
+        "hospital_name": np.array(scheduler.dists.names),
+        "north": scheduler.hosp_df["north"].to_numpy(),
+        "east": scheduler.hosp_df["east"].to_numpy(),
+        "dist_matrix": scheduler.dist_matrix,
+        "zip_return_time": np.array([z.return_time for z in scheduler.ZipList], dtype=float),
+        "zip_leaving_time": np.array([z.leaving_time for z in scheduler.ZipList], dtype=float),
+        "zip_trips_made": np.array([z.trips_made for z in scheduler.ZipList], dtype=np.int64),
+        "zip_flight_speed": np.array([z.flight_speed for z in scheduler.ZipList], dtype=float),
+    }
+    for name, _ in QUEUES:
+        queue = getattr(scheduler, name)
+        snap[name + "_order_id"] = np.array([o.order_id for o in queue], dtype=np.int64)
+        snap[name + "_received_time"] = np.array([o.received_time for o in queue], dtype=float)
+        snap[name + "_hospital_id"] = np.array([o.hospital_id for o in queue], dtype=np.int64)
+    return snap
+
+
+def restore(snap, cls=None, **kwargs):
+    """
+    Builds a scheduler from a snapshot, as its original class or as cls.
+    Extra kwargs go to the constructor (e.g. route_cache_size).
+    """
+    config = json.loads(str(snap["config"]))
+    cls = cls or SCHEDULERS[config["scheduler"]]
+
+    hosp_df = pd.DataFrame({"hospital_name": snap["hospital_name"].tolist(),
+                            "north": snap["north"], "east": snap["east"]})
+    dists = DistanceMatrix(hosp_df, snap["dist_matrix"].copy())
+    scheduler = cls(hosp_df, config["total_zips"], config["max_load"], config["flight_speed"],
+                    config["max_range"], dists=dists, base=config["base"], **kwargs)
+
+    for z, return_time, leaving_time, trips_made, flight_speed in zip(
+            scheduler.ZipList, snap["zip_return_time"].tolist(), snap["zip_leaving_time"].tolist(),
+            snap["zip_trips_made"].tolist(), snap["zip_flight_speed"].tolist()):
+        z.return_time = return_time
+        z.leaving_time = leaving_time
+        z.trips_made = trips_made
+        z.flight_speed = flight_speed
+    scheduler.fleet = Fleet(scheduler.ZipList)
+
+    names = dists.names
+    for name, priority in QUEUES:
+        queue = getattr(scheduler, name)
+        for order_id, received_time, hospital_id in zip(snap[name + "_order_id"].tolist(),
+                                                        snap[name + "_received_time"].tolist(),
+                                                        snap[name + "_hospital_id"].tolist()):
+            queue.append(Order(order_id, received_time, names[hospital_id], hospital_id, priority))
+    scheduler.next_order_id = config["next_order_id"]
+    return scheduler
+
+
+def fork(snap, classes, **kwargs):
+    # one independent scheduler per class, all starting from snap
+    return [restore(snap, cls, **kwargs) for cls in classes]
+
+
+def save(scheduler, path):
+    np.savez(path, **snapshot(scheduler))
+
+
+def load_snapshot(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def load(path, cls=None, **kwargs):
+    return restore(load_snapshot(path), cls, **kwargs)
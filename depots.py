@@ -0,0 +1,153 @@
+'''
+Multi-depot scheduling.
+
+DepotCoordinator runs one scheduler per named depot, each with its own
+fleet and queues, over one shared distance matrix. Every hospital belongs
+to its nearest depot that can reach it; when a depot has no idle zip,
+waiting orders overflow to the next nearest depot that can reach them and
+has one. simulate(coordinator, orders, batch=True) runs the whole network,
+simulate_shards runs each depot on its own orders in parallel workers.
+
+'''
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from zipline import ZipScheduler, DistanceMatrix
+from simulation import simulate
+
+
+class DepotCoordinator:
+    """
+    Methods
+    ------
+    queue_order - queues an order at its hospital's home depot
+    schedule_flights - moves emergencies stuck at depots with no idle zip
+                       to other depots that can reach them, schedules
+                       every depot, then does the same for the orders
+                       still stuck and schedules again
+    zips_available - idle zips across all depots
+    next_free_time - when the next zip in the network lands
+    waiting_on_zip - whether any depot has orders queued and no idle zip
+    wake_time - earliest wake_time over the depots
+    split_orders - orders DataFrame split by home depot
+    """
+
+    def __init__(self, hosp_df, depots, scheduler_class=ZipScheduler, total_zips=10, **kwargs):
+        # depots: {name: (north, east)}; total_zips: per depot, or {name: zips}
+        hospitals = hosp_df[~hosp_df["hospital_name"].isin(list(depots) + ["base"])]
+        depot_df = pd.DataFrame([(name, north, east) for name, (north, east) in depots.items()],
+                                columns=["hospital_name", "north", "east"])
+        self.hosp_df = pd.concat([hospitals, depot_df], ignore_index=True)
+        dists = DistanceMatrix(self.hosp_df)
+
+        self.shards = {}
+        # ids are given out here, so orders can move between depots
+        self.next_order_id = 0
+        self.total_zips = 0
+        for name in depots:
+            zips = total_zips[name] if isinstance(total_zips, dict) else total_zips
+            shard = scheduler_class(self.hosp_df, total_zips=zips, dists=dists, base=name, **kwargs)
+            self.shards[name] = shard
+            self.total_zips += zips
+
+        # for every hospital, the depots that can reach it, nearest first
+        names = list(depots)
+        depot_rows = [dists.index[name] for name in names]
+        max_range = next(iter(self.shards.values())).max_range
+        self.depot_order = {}
+        for hospital in hospitals["hospital_name"]:
+            d = dists.matrix[depot_rows, dists.index[hospital]]
+            by_distance = np.argsort(d, kind="stable")
+            reachable = [names[i] for i in by_distance if 2*d[i] < max_range]
+            self.depot_order[hospital] = reachable or [names[by_distance[0]]]
+
+    @property
+    def emergency(self):
+        # number of emergency orders queued across depots
+        return sum(len(shard.emergency) for shard in self.shards.values())
+
+    @property
+    def resupply(self):
+        return sum(len(shard.resupply) for shard in self.shards.values())
+
+    def queue_order(self, received_time, hospital, priority):
+        home = self.depot_order[hospital.strip()][0]
+        self.shards[home].queue_order(received_time, hospital, priority, self.next_order_id)
+        self.next_order_id += 1
+
+    def zips_available(self, current_time):
+        return sum(shard.zips_available(current_time) for shard in self.shards.values())
+
+    def next_free_time(self, current_time):
+        times = [shard.next_free_time(current_time) for shard in self.shards.values()]
+        return min((t for t in times if t is not None), default=None)
+
+    def waiting_on_zip(self, current_time):
+        return any(shard.waiting_on_zip(current_time) for shard in self.shards.values())
+
+    def wake_time(self, current_time):
+        # earliest landing at a depot whose own orders are waiting on a zip;
+        # an idle zip at another depot doesn't help orders that can't overflow
+        times = [shard.wake_time(current_time) for shard in self.shards.values()]
+        return min((t for t in times if t is not None), default=None)
+
+    def overflow(self, current_time, queue_names=("emergency", "resupply")):
+        # move orders waiting at depots with no idle zip; returns depots that got any
+        capacity = {name: shard.zips_available(current_time)*shard.max_load
+                    for name, shard in self.shards.items()}
+        receivers = set()
+        for name, shard in self.shards.items():
+            if capacity[name]:
+                continue
+            for queue_name in queue_names:
+                queue = getattr(shard, queue_name)
+                for order in list(queue):
+                    target = next((other for other in self.depot_order[order.hospital]
+                                   if capacity[other]), None)
+                    if target:
+                        queue.remove(order)
+                        # in line by received_time, not behind newer local orders
+                        getattr(self.shards[target], queue_name).insert(order)
+                        capacity[target] -= 1
+                        receivers.add(target)
+        return receivers
+
+    def schedule_flights(self, current_time):
+        # emergencies stuck at busy depots move first, so a helper depot's
+        # idle zips go to them before its own resupply orders
+        self.overflow(current_time, ("emergency",))
+        flights = []
+        for shard in self.shards.values():
+            flights += shard.schedule_flights(current_time)
+        for name in self.overflow(current_time):
+            flights += self.shards[name].schedule_flights(current_time)
+        return flights
+
+    def split_orders(self, orders_df):
+        home = orders_df["hospital_name"].str.strip().map(lambda h: self.depot_order[h][0])
+        return {name: orders_df[home == name] for name in self.shards}
+
+
+def _simulate_shard(args):
+    shard, orders_df, start_time, end_time, batch = args
+    return simulate(shard, orders_df, start_time, end_time, batch=batch)
+
+
+def simulate_shards(coordinator, orders_df, start_time=25640, end_time=71840,
+                    batch=False, processes=None):
+    """
+    Simulates every depot on its own orders, one worker process per depot,
+    with no overflow between them. Workers get copies of the shards, so the
+    coordinator itself is left untouched. Returns {depot: metrics}.
+    """
+    split = coordinator.split_orders(orders_df)
+    names = list(coordinator.shards)
+    tasks = [(coordinator.shards[name], split[name], start_time, end_time, batch)
+             for name in names]
+    processes = min(processes or len(tasks), len(tasks))
+    if processes <= 1:
+        results = [_simulate_shard(task) for task in tasks]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_simulate_shard, tasks, chunksize=1)
+    return dict(zip(names, results))
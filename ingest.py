@@ -0,0 +1,90 @@
+'''
+Streaming order ingestion.
+
+Reads orders from CSV or JSONL files in chunks, or from any iterator of
+(received_time, hospital_name, priority) rows, and hands them on in time
+order. Only the look-ahead window is ever held in memory.
+
+'''
+import os
+import json
+import heapq
+import warnings
+from collections import namedtuple
+from itertools import count
+import pandas as pd
+from zipline import ORDER_COLUMNS
+
+OrderRow = namedtuple("OrderRow", ORDER_COLUMNS)
+
+
+def read_csv_orders(path, chunksize=10000):
+    for chunk in pd.read_csv(path, names=ORDER_COLUMNS, chunksize=chunksize):
+        for row in chunk.itertuples(index=False):
+            yield OrderRow._make(row)
+
+
+def read_jsonl_orders(path):
+    # one {"received_time": ..., "hospital_name": ..., "priority": ...} per line
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                yield OrderRow._make(record[column] for column in ORDER_COLUMNS)
+
+
+def iter_orders(source, chunksize=10000):
+    # orders from a DataFrame, a .csv/.jsonl path or any iterator of rows
+    if isinstance(source, pd.DataFrame):
+        return map(OrderRow._make, source[ORDER_COLUMNS].itertuples(index=False))
+    if isinstance(source, (str, os.PathLike)):
+        if str(source).endswith((".jsonl", ".json")):
+            return read_jsonl_orders(source)
+        return read_csv_orders(source, chunksize)
+    return map(OrderRow._make, source)
+
+
+def time_ordered(orders, lookahead=0):
+    """
+    Yields orders sorted by received_time, allowing rows to arrive up to
+    lookahead seconds out of order. Rows later than that are passed on as
+    soon as they are seen.
+    """
+    heap = []
+    seq = count()
+    for order in orders:
+        heapq.heappush(heap, (order.received_time, next(seq), order))
+        # nothing older than this can still turn up
+        while heap[0][0] < order.received_time - lookahead:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def order_batches(orders, lookahead=0):
+    """
+    (event_time, [orders received then]) in time order. A row later than
+    lookahead allows keeps its received_time, so its wait is still measured
+    from when it was placed, but joins the batch at the current event time,
+    so time never goes backwards. The first such row raises a warning.
+    """
+    event_time = None
+    batch = []
+    late = False
+    for order in time_ordered(orders, lookahead):
+        at = order.received_time
+        if event_time is not None and at < event_time:
+            if not late:
+                warnings.warn("order received at %s arrived after %s; orders are more than "
+                              "lookahead=%s seconds out of order, sort the input or raise "
+                              "lookahead" % (at, event_time, lookahead), stacklevel=2)
+                late = True
+            at = event_time
+        if batch and at != event_time:
+            yield event_time, batch
+            batch = []
+        event_time = at
+        batch.append(order)
+    if batch:
+        yield event_time, batch
@@ -0,0 +1,173 @@
+'''
+Optional instrumentation for schedulers.
+
+instrument(scheduler, sink) wraps the scheduling hot paths of one scheduler
+instance so that every call reports its latency, and every scheduling
+decision reports queue depths, idle zips and why no flight left. Nothing is
+wrapped until instrument is called, so an uninstrumented scheduler pays
+nothing.
+
+Sinks take timing(name, seconds), count(name, n) and gauge(name, value):
+MemorySink keeps counters and log2 histograms, JsonlSink writes a trace.
+
+'''
+import json
+import math
+from functools import wraps
+from time import perf_counter
+from zipline import FlightStatus
+
+# range checks against a PartialRoute happen inside find_in_range (and
+# Greedy's find_next); route_distance is off the hot path, so isn't timed
+TIMED = ("find_orders", "find_next", "find_in_range", "plan_route", "send_zip",
+         "shortest_path")
+DECISIONS = ("schedule_next_flight", "schedule_flights")
+
+
+class Histogram:
+    """
+    Counts of values in power-of-two buckets, with exact count/total/max.
+    """
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        bucket = math.frexp(value)[1] if value > 0 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # upper edge of the bucket holding the q-th value
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= q*self.count:
+                return min(math.ldexp(1, bucket), self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "mean": self.total/self.count if self.count else 0,
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99), "max": self.max}
+
+
+class MemorySink:
+    """
+    Keeps counters, latency histograms (seconds) and gauge histograms.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.timings = {}
+        self.gauges = {}
+
+    def timing(self, name, seconds):
+        if name not in self.timings:
+            self.timings[name] = Histogram()
+        self.timings[name].add(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        if name not in self.gauges:
+            self.gauges[name] = Histogram()
+        self.gauges[name].add(value)
+
+    def summary(self):
+        return {"counters": dict(self.counters),
+                "timings": {k: h.summary() for k, h in self.timings.items()},
+                "gauges": {k: h.summary() for k, h in self.gauges.items()}}
+
+
+class JsonlSink:
+    """
+    Writes every measurement as one JSON line to a path or open file.
+    """
+
+    def __init__(self, out):
+        self.own_file = isinstance(out, str)
+        self.f = open(out, "w") if self.own_file else out
+
+    def write(self, kind, name, value):
+        self.f.write(json.dumps({"type": kind, "name": name, "value": value}) + "\n")
+
+    def timing(self, name, seconds):
+        self.write("timing", name, seconds)
+
+    def count(self, name, n=1):
+        self.write("count", name, n)
+
+    def gauge(self, name, value):
+        self.write("gauge", name, value)
+
+    def close(self):
+        if self.own_file:
+            self.f.close()
+
+
+def _timed(name, method, sink):
+    @wraps(method)
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            sink.timing(name, perf_counter() - start)
+            sink.count(name)
+    return timed
+
+
+def _decision(scheduler, name, method, sink):
+    @wraps(method)
+    def decision(current_time):
+        waiting = len(scheduler.emergency) + len(scheduler.resupply)
+        sink.gauge("emergency_depth", len(scheduler.emergency))
+        sink.gauge("resupply_depth", len(scheduler.resupply))
+        sink.gauge("idle_zips", scheduler.zips_available(current_time))
+
+        start = perf_counter()
+        ans = method(current_time)
+        sink.timing(name, perf_counter() - start)
+
+        if isinstance(ans, list):
+            flights = ans
+            no_zip = (scheduler.emergency or scheduler.resupply) and not scheduler.zips_available(current_time)
+        else:
+            flights = [ans] if ans.launched else []
+            no_zip = ans.status is FlightStatus.NO_ZIP and waiting
+
+        if flights:
+            sink.count("flights", len(flights))
+            sink.count("orders_delivered", sum(len(f.orders) for f in flights))
+        elif waiting and not no_zip:
+            # zips were free and orders queued, but nothing could be flown
+            sink.count("rejected.out_of_range")
+        if no_zip:
+            sink.count("rejected.no_zip_available")
+        return ans
+    return decision
+
+
+def instrument(scheduler, sink):
+    # wrap this scheduler's hot paths; calls uninstrument first so it never nests
+    uninstrument(scheduler)
+    for name in TIMED:
+        if hasattr(scheduler, name):
+            setattr(scheduler, name, _timed(name, getattr(scheduler, name), sink))
+    for name in DECISIONS:
+        setattr(scheduler, name, _decision(scheduler, name, getattr(scheduler, name), sink))
+    return scheduler
+
+
+def uninstrument(scheduler):
+    # drop the per-instance wrappers, back to the plain class methods
+    for name in TIMED + DECISIONS:
+        scheduler.__dict__.pop(name, None)
+    return scheduler
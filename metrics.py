@@ -0,0 +1,135 @@
+'''
+Run metrics for simulations.
+
+FlightMetrics collects per-order waits (by priority), per-flight times,
+zip busy time and unavailable counts for one run into preallocated NumPy
+arrays, and summarises them as means and p50/p95/p99. Memory is bounded:
+each series keeps at most capacity values, and past that a uniform
+reservoir sample (count, mean and max stay exact). save_results writes
+summaries from several runs to Parquet or CSV for comparison.
+
+'''
+import numpy as np
+import pandas as pd
+from zipline import Priority
+
+QUANTILES = (50, 95, 99)
+
+
+class Samples:
+    """
+    A series of float values in a preallocated array.
+
+    Methods
+    ------
+    add - adds one value; once capacity is reached, values are kept as a
+          uniform reservoir sample
+    mean - exact mean of every value added (nan if none)
+    percentiles - percentiles of the kept values (nan if none)
+    """
+    __slots__ = ("values", "capacity", "size", "count", "total", "max", "rng")
+
+    def __init__(self, capacity=65536, seed=0):
+        self.capacity = capacity
+        self.values = np.empty(min(capacity, 1024))
+        self.size = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = np.nan
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if not value <= self.max:
+            self.max = value
+
+        if self.size < self.capacity:
+            if self.size == len(self.values):
+                # grow geometrically, never past capacity
+                grown = np.empty(min(2*len(self.values), self.capacity))
+                grown[:self.size] = self.values
+                self.values = grown
+            self.values[self.size] = value
+            self.size += 1
+        else:
+            i = self.rng.integers(self.count)
+            if i < self.capacity:
+                self.values[i] = value
+
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+    def percentiles(self, q=QUANTILES):
+        if not self.size:
+            return [np.nan] * len(q)
+        return list(np.percentile(self.values[:self.size], q))
+
+    def __len__(self):
+        return self.count
+
+
+class FlightMetrics:
+    """
+    Metrics for one simulation over [start_time, end_time).
+
+    Methods
+    ------
+    add_flight - records a launched FlightResult: one wait per order, one
+                 flight time per flight, and busy zip time inside the window
+    add_unavailable - counts one decision point with orders but no zip
+    summary - flat dict of counts, means, percentiles and zip utilization
+    """
+
+    def __init__(self, start_time, end_time, total_zips=None, capacity=65536):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.total_zips = total_zips
+        self.wait_emergency = Samples(capacity, seed=0)
+        self.wait_resupply = Samples(capacity, seed=1)
+        self.flight_time = Samples(capacity, seed=2)
+        self.count_unavailable = 0
+        self.busy_time = 0.0
+
+    def add_flight(self, current_time, flight):
+        for order in flight.wait_times:
+            if order.priority is Priority.EMERGENCY:
+                self.wait_emergency.add(order.wait)
+            elif order.priority is Priority.RESUPPLY:
+                self.wait_resupply.add(order.wait)
+        self.flight_time.add(flight.flight_time)
+        # time after the window closes doesn't count towards utilization
+        self.busy_time += min(flight.flight_time, self.end_time - current_time)
+
+    def add_unavailable(self):
+        self.count_unavailable += 1
+
+    def utilization(self):
+        zip_time = (self.total_zips or 0) * (self.end_time - self.start_time)
+        return self.busy_time / zip_time if zip_time > 0 else np.nan
+
+    def summary(self):
+        results = {"count_unavailable": self.count_unavailable,
+                   "flights": len(self.flight_time),
+                   "utilization": self.utilization()}
+        for name in ("wait_emergency", "wait_resupply", "flight_time"):
+            samples = getattr(self, name)
+            results[name] = samples.mean()
+            for q, value in zip(QUANTILES, samples.percentiles()):
+                results["{}_p{}".format(name, q)] = value
+        return results
+
+
+def save_results(results, path):
+    '''
+    Writes run summaries (a DataFrame, a dict or a list of dicts) to path,
+    as Parquet for .parquet (needs pyarrow or fastparquet), else as CSV.
+    '''
+    if isinstance(results, dict):
+        results = [results]
+    df = pd.DataFrame(results)
+    if str(path).endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return df
@@ -4,6 +4,8 @@ Implements modified/enhanced schedulers, ZipScheduler_NextOrd, ZipScheduler_Gree
 (Modified schedulers in schedulers.py)
 
 '''
+from collections import OrderedDict
+from itertools import combinations, permutations
 from zipline import Zip, ZipScheduler
 import pandas as pd
 import numpy as np
@@ -14,13 +16,14 @@ class ZipScheduler_NextOrd(ZipScheduler):
     A class that just takes the next order that's within range
     """
 
-    def __init__(self, hosp_df, total_zips=10, max_load=3, flight_speed=30, max_range=160000):
-        ZipScheduler.__init__(self, hosp_df, total_zips, max_load, flight_speed, max_range)
+    def __init__(self, hosp_df, total_zips=10, max_load=3, flight_speed=30, max_range=160000,
+                 dists=None, base="base"):
+        ZipScheduler.__init__(self, hosp_df, total_zips, max_load, flight_speed, max_range,
+                              dists, base)
 
-    def find_next(self, queue, *args):
+    def find_next(self, queue, route):
         # find next order in given queue that is within flight range, else returns None
-        close_hosp = next((order for order in queue
-                           if self.route_distance(*args, order) < self.max_range), None)
+        close_hosp = self.find_in_range(queue, route)
         if close_hosp:
             new_queue = self.q_remove(queue, close_hosp)
             return close_hosp, new_queue
@@ -31,14 +34,22 @@ class ZipScheduler_Greedy(ZipScheduler):
     A class that finds the closest hospital in queue for each next order
     '''
 
-    def __init__(self, hosp_df, total_zips=10, max_load=3, flight_speed=30, max_range=160000):
-        ZipScheduler.__init__(self, hosp_df, total_zips, max_load, flight_speed, max_range)
+    def __init__(self, hosp_df, total_zips=10, max_load=3, flight_speed=30, max_range=160000,
+                 dists=None, base="base"):
+        ZipScheduler.__init__(self, hosp_df, total_zips, max_load, flight_speed, max_range,
+                              dists, base)
 
-    def find_next(self, queue, *args):
+    def find_next(self, queue, route):
         if queue:
-            # sort by distance to last order
-            closest_hosp = sorted(queue, key=lambda x: self.route_distance(*args, x))[0]
-            if closest_hosp and self.route_distance(*args, closest_hosp) < self.max_range:
+            orders = list(queue)
+            hosps = np.fromiter((o.hospital_id for o in orders), dtype=np.intp, count=len(orders))
+            dists = route.with_stops(hosps)
+
+            # argmin takes the first of equal distances, i.e. queue order; if the
+            # closest is out of range, every other order is too
+            i = int(np.argmin(dists))
+            if dists[i] < self.max_range:
+                closest_hosp = orders[i]
                 new_queue = self.q_remove(queue, closest_hosp)
                 return closest_hosp, new_queue
         return None, queue
@@ -46,78 +57,98 @@ class ZipScheduler_Greedy(ZipScheduler):
 
 class ZipScheduler_SP(ZipScheduler):
     '''
-    A class that implements a shortest path algorithm for order length > 2
+    A class that finds the exact shortest route for order length > 2
+
+    Routes are solved by trying every permutation for small loads and with
+    Held-Karp for larger ones. Solved routes are kept in an LRU cache keyed
+    on the set of hospitals visited.
     '''
 
-    def __init__(self, hosp_df, total_zips=10, max_load=3, flight_speed=30, max_range=160000):
-        ZipScheduler.__init__(self, hosp_df, total_zips, max_load, flight_speed, max_range)
+    # largest number of distinct hospitals solved by brute force
+    permutation_limit = 6
+
+    def __init__(self, hosp_df, total_zips=10, max_load=3, flight_speed=30, max_range=160000,
+                 dists=None, base="base", route_cache_size=4096):
+        ZipScheduler.__init__(self, hosp_df, total_zips, max_load, flight_speed, max_range,
+                              dists, base)
+        self.route_cache_size = route_cache_size
+        self.route_cache = OrderedDict()
 
     def shortest_path(self, *args):
-        best_route = []
-        best_length = float('inf')
         orders = [arg for arg in args]
 
-        for i_order, order in enumerate(orders):
-            route = [i_order]
-            length = self.dists["base"][order["hospital"]]
+        # orders to the same hospital are delivered on the same stop
+        stops = OrderedDict()
+        for order in orders:
+            stops.setdefault(self.hosp_index[order["hospital"]], []).append(order)
+        key = tuple(sorted(stops))
 
-            while len(route) < len(orders):
-                i_order, nextord, dist = self.get_closest(i_order, orders, route)
-                length += dist
-                route.append(i_order)
+        if key in self.route_cache:
+            self.route_cache.move_to_end(key)
+            best_route, best_length = self.route_cache[key]
+        else:
+            best_route, best_length = self.solve_route(key)
+            self.route_cache[key] = (best_route, best_length)
+            if len(self.route_cache) > self.route_cache_size:
+                self.route_cache.popitem(last=False)
+
+        best_route_orders = [order for h in best_route for order in stops[h]]
 
-            try:
-                length += self.dists["base"][nextord["hospital"]]
-            except:
-                length += self.dists["base"][order["hospital"]]
+        return best_route_orders, best_length
 
+    def solve_route(self, hosps):
+        # optimal base -> hosps -> base tour over hospital indices
+        if len(hosps) <= self.permutation_limit:
+            return self.solve_permutations(hosps)
+        return self.solve_held_karp(hosps)
+
+    def tour_length(self, route):
+        m = self.dist_matrix
+        length = m[self.base, route[0]]
+        for i in range(len(route) - 1):
+            length += m[route[i], route[i+1]]
+        return length + m[route[-1], self.base]
+
+    def solve_permutations(self, hosps):
+        best_route = None
+        best_length = float('inf')
+        for route in permutations(hosps):
+            length = self.tour_length(route)
             if length < best_length:
                 best_length = length
                 best_route = route
-
-        best_route_orders = [orders[i] for i in best_route]
-
-        return best_route_orders, best_length
-
-    def get_closest(self, i_order, orders, visited):
-        best_distance = float('inf')
-
-        for i, o in enumerate(orders):
-            if i not in visited:
-                distance = self.dists[o["hospital"]][orders[i_order]["hospital"]]
-
-                if distance < best_distance:
-                    closest = o
-                    i_closest = i
-                    best_distance = distance
-
-        return i_closest, closest, best_distance
-
-    def schedule_next_flight(self, current_time):
-        # first order will be first in line by default
-        if self.zips_available(current_time):
-
-            orders = self.find_orders()
-
-            if orders:
-                if len(orders) > 2:
-                    best_route, dist_to_travel = self.shortest_path(*orders)
-                else:
-                    best_route, dist_to_travel = orders, self.route_distance(*orders)
-
-                wait_times = [{"priority": order["priority"],
-                               "wait": (current_time - order["received_time"])}
-                               for order in best_route]
-
-                # find next available zip, deploy if available
-                return_time = self.send_zip(current_time, dist_to_travel)
-                if return_time:
-                    flight_time = return_time - current_time
-                    return best_route, wait_times, flight_time
-                else:
-                    return "No available zips right now, please wait"
-            else:
-                return None
-
-        else:
-            return "No available zips right now, please wait"
+        return best_route, best_length
+
+    def solve_held_karp(self, hosps):
+        m = self.dist_matrix
+        k = len(hosps)
+
+        # cost[mask][j] = (shortest path from base through mask ending at j, previous stop)
+        cost = [{} for _ in range(1 << k)]
+        for j in range(k):
+            cost[1 << j][j] = (m[self.base, hosps[j]], None)
+
+        for size in range(2, k + 1):
+            for subset in combinations(range(k), size):
+                mask = sum(1 << j for j in subset)
+                for j in subset:
+                    prev = cost[mask & ~(1 << j)]
+                    cost[mask][j] = min((prev[i][0] + m[hosps[i], hosps[j]], i)
+                                        for i in subset if i != j)
+
+        full = (1 << k) - 1
+        best_length, j = min((cost[full][j][0] + m[hosps[j], self.base], j)
+                             for j in range(k))
+
+        # walk back from the last stop
+        route = []
+        mask = full
+        while j is not None:
+            route.append(hosps[j])
+            j, mask = cost[mask][j][1], mask & ~(1 << j)
+        return tuple(reversed(route)), best_length
+
+    def plan_route(self, route):
+        if len(route) > 2:
+            return self.shortest_path(*route)
+        return ZipScheduler.plan_route(self, route)
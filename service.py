@@ -0,0 +1,162 @@
+'''
+Asyncio dispatch service wrapping a scheduler for live order intake.
+
+Orders come in through submit() or over a local socket (one JSON object
+per line), and launched flights are published to every subscriber. The
+service sleeps until an order arrives or the next zip lands, never on a
+fixed tick. Queueing and scheduling run in a single worker thread, so route
+computation (e.g. ZipScheduler_SP.shortest_path) never blocks the event
+loop and the scheduler is only ever touched by one thread.
+
+    service = DispatchService(ZipScheduler_SP(load_hospitals()))
+    flights = service.subscribe()
+    asyncio.create_task(service.run())
+    await service.serve("127.0.0.1", 8765)
+
+'''
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from zipline import Priority
+
+
+class DispatchService:
+    """
+    Methods
+    ------
+    submit - validates and queues an order received now
+    subscribe - returns an asyncio.Queue that receives every launched flight
+    run - main loop: batches arrivals, schedules, publishes, sleeps
+    stop - ends run
+    shutdown_executor - stops the worker thread run started
+    serve - accepts orders and subscriptions over a local TCP socket
+    """
+
+    def __init__(self, scheduler, clock=time.monotonic, executor=None):
+        self.scheduler = scheduler
+        self.clock = clock
+        # a worker thread is started by run and shut down when it ends,
+        # unless the caller passed in their own executor
+        self.executor = executor
+        self.owns_executor = executor is None
+        self.inbox = asyncio.Queue()
+        self.subscribers = []
+        self.running = False
+
+    def subscribe(self):
+        queue = asyncio.Queue()
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.remove(queue)
+
+    def submit(self, hospital, priority):
+        hospital = hospital.strip()
+        if hospital not in self.scheduler.hosp_index:
+            raise ValueError("unknown hospital %r" % hospital)
+        priority = Priority(priority.strip())
+        received_time = self.clock()
+        self.inbox.put_nowait((received_time, hospital, priority.value))
+        return received_time
+
+    def stop(self):
+        self.running = False
+        self.inbox.put_nowait(None)
+        self.shutdown_executor()
+
+    def shutdown_executor(self):
+        # a step already running finishes, nothing new is accepted
+        if self.owns_executor and self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def step(self, arrivals, current_time):
+        # runs in the worker thread: queue the burst, fill every free zip
+        for order in arrivals:
+            self.scheduler.queue_order(*order)
+        flights = self.scheduler.schedule_flights(current_time)
+
+        return flights, self.scheduler.wake_time(current_time)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        executor = self.executor
+        self.running = True
+        wake_time = None
+
+        try:
+            while self.running:
+                timeout = None if wake_time is None else max(wake_time - self.clock(), 0)
+                arrivals = []
+                try:
+                    arrivals.append(await asyncio.wait_for(self.inbox.get(), timeout))
+                except asyncio.TimeoutError:
+                    pass
+                # take the whole burst in one step
+                while not self.inbox.empty():
+                    arrivals.append(self.inbox.get_nowait())
+                arrivals = [order for order in arrivals if order is not None]
+                if not self.running:
+                    break
+
+                flights, wake_time = await loop.run_in_executor(
+                    executor, self.step, arrivals, self.clock())
+                for flight in flights:
+                    for queue in self.subscribers:
+                        queue.put_nowait(flight)
+        finally:
+            self.shutdown_executor()
+
+    async def handle_client(self, reader, writer):
+        # {"hospital": ..., "priority": ...} queues an order,
+        # {"subscribe": true} streams every flight back on this connection
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if request.get("subscribe"):
+                        await self.stream_flights(reader, writer)
+                        break
+                    received_time = self.submit(request["hospital"], request["priority"])
+                    reply = {"status": "queued", "received_time": received_time}
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    reply = {"status": "error", "error": str(e)}
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def stream_flights(self, reader, writer):
+        queue = self.subscribe()
+        # finishes when the client hangs up
+        closed = asyncio.ensure_future(reader.read())
+        try:
+            while True:
+                get = asyncio.ensure_future(queue.get())
+                await asyncio.wait({get, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if closed.done():
+                    get.cancel()
+                    break
+                flight = get.result()
+                message = {"orders": [{"hospital": o.hospital, "priority": o.priority.value,
+                                       "received_time": o.received_time}
+                                      for o in flight.orders],
+                           "flight_time": flight.flight_time}
+                writer.write((json.dumps(message) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            closed.cancel()
+            self.unsubscribe(queue)
+
+    async def serve(self, host="127.0.0.1", port=0):
+        # returns the asyncio server; port 0 picks a free port
+        return await asyncio.start_server(self.handle_client, host, port)
@@ -0,0 +1,99 @@
+'''
+Discrete-event simulation of a scheduler over a stream of orders.
+
+Events are order arrivals and zip returns, kept on a heap. The scheduler is
+only asked to schedule when one of these happens, and keeps launching flights
+until it runs out of zips or orders. Orders are pulled from the source one
+batch at a time, so files and live streams never need to fit in memory.
+
+'''
+import heapq
+from itertools import count
+import pandas as pd
+from zipline import FlightStatus
+from ingest import iter_orders, order_batches
+from metrics import FlightMetrics
+
+ORDER_ARRIVAL = 0
+ZIP_RETURN = 1
+
+
+def simulate(scheduler, orders, start_time=25640, end_time=71840, lookahead=0, batch=False):
+    """
+    Replays orders received in [start_time, end_time) through scheduler.
+
+    orders is a DataFrame, a .csv/.jsonl path or an iterator of rows (see
+    ingest.iter_orders). Streams should be in time order, give or take
+    lookahead seconds. With batch, idle zips are filled together through
+    scheduler.schedule_flights instead of one schedule_next_flight at a time.
+
+    Returns FlightMetrics.summary(): means and p50/p95/p99 of waits by
+    priority and of flight times (one per flight), flight count and zip
+    utilization. count_unavailable is the number of decision points
+    (arrival or return) at which orders were waiting but every zip was out.
+    """
+    if not batch and not hasattr(scheduler, "schedule_next_flight"):
+        # e.g. a DepotCoordinator, which only fills zips through schedule_flights
+        raise TypeError("%s has no schedule_next_flight, simulate it with batch=True"
+                        % type(scheduler).__name__)
+    metrics = FlightMetrics(start_time, end_time, getattr(scheduler, "total_zips", None))
+
+    if isinstance(orders, pd.DataFrame):
+        in_window = orders["received_time"].between(start_time, end_time - 1)
+        orders = orders[in_window].sort_values("received_time", kind="mergesort")
+    order_stream = order_batches(iter_orders(orders), lookahead)
+
+    # (time, kind, seq, payload); seq keeps ties in insertion order
+    events = []
+    seq = count()
+
+    def push_next_batch():
+        for received_time, arrivals in order_stream:
+            if received_time >= end_time:
+                # stop reading, the rest of the stream is after the window
+                return
+            if received_time >= start_time:
+                heapq.heappush(events, (received_time, ORDER_ARRIVAL, next(seq), arrivals))
+                return
+
+    push_next_batch()
+
+    while events:
+        current_time = events[0][0]
+        if current_time >= end_time:
+            break
+
+        # handle everything that happens at this instant before scheduling
+        while events and events[0][0] == current_time:
+            _, kind, _, arrivals = heapq.heappop(events)
+            if kind == ORDER_ARRIVAL:
+                for order in arrivals:
+                    scheduler.queue_order(order.received_time, order.hospital_name, order.priority)
+                push_next_batch()
+
+        # launch flights while zips and orders remain
+        if batch:
+            flights = scheduler.schedule_flights(current_time)
+            waiting = scheduler.waiting_on_zip(current_time)
+        else:
+            flights = []
+            waiting = False
+            while scheduler.emergency or scheduler.resupply:
+                ans = scheduler.schedule_next_flight(current_time)
+                if ans.status is FlightStatus.NO_ZIP:
+                    waiting = True
+                if not ans.launched:
+                    break
+                flights.append(ans)
+
+        for flight in flights:
+            metrics.add_flight(current_time, flight)
+
+        # orders are waiting on a zip, wake up when the next one lands
+        if waiting:
+            metrics.add_unavailable()
+            return_time = scheduler.wake_time(current_time)
+            if return_time is not None:
+                heapq.heappush(events, (return_time, ZIP_RETURN, next(seq), None))
+
+    return metrics.summary()
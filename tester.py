@@ -2,79 +2,103 @@
 Tests different schedulers for performance.
 
 Returns for each scheduler:
-Number of times a zip was unavailable
-Mean wait time for emergency (seconds)
-Mean wait time for resupply (seconds)
-Mean flight time for delivery (seconds)
+Number of times orders were waiting but no zip was available
+Mean and p50/p95/p99 wait time for emergency (seconds)
+Mean and p50/p95/p99 wait time for resupply (seconds)
+Mean and p50/p95/p99 flight time per flight (seconds)
+Zip utilization (share of zip time spent flying)
 
-'''
-import pandas as pd
-import numpy as np
-from zipline import Zip, ZipScheduler
-from schedulers import ZipScheduler_Greedy, ZipScheduler_SP, ZipScheduler_NextOrd
-
-def test_scheduler(scheduler, start_time = 25640, end_time = 71840, interval = 60):
-
-    count_unavailable = 0
-    wait_time_em = []
-    wait_time_re = []
-    flight_time = []
+python tester.py results.csv (or .parquet) also saves the results, one row
+per scheduler, for comparing runs.
 
-    for i in range(start_time, end_time, interval):
 
-        for _, order in orders_df[orders_df['received_time'].between(i-interval, i-1, inclusive=True)].iterrows():
-            scheduler.queue_order(order["received_time"], order["hospital_name"], order["priority"])
+run_sweep runs a grid of schedulers and parameters in a process pool.
 
-        ans = scheduler.schedule_next_flight(i)
-
-        if ans:
-            if 'available' in ans:
-                count_unavailable += 1
-            else:
-                for order in ans[1]:
-                    if order["priority"] == 'Emergency':
-                        wait_time_em.append(order["wait"])
-                    if order["priority"] == 'Resupply':
-                        wait_time_re.append(order["wait"])
-                    flight_time.append(ans[2])
-
-    return {"count_unavailable": count_unavailable,
-             "wait_emergency": np.mean(wait_time_em),
-             "wait_resupply": np.mean(wait_time_re),
-             "flight_time": np.mean(flight_time)}
+'''
+import os
+import sys
+from itertools import product
+from multiprocessing import Pool
+import pandas as pd
+from zipline import ZipScheduler, load_hospitals, load_orders
+from schedulers import ZipScheduler_Greedy, ZipScheduler_SP, ZipScheduler_NextOrd
+from simulation import simulate
+from metrics import save_results
+
+def test_scheduler(scheduler, start_time = 25640, end_time = 71840, interval = 60, *,
+                   orders_df = None):
+    # interval is unused (the simulation is event-driven), kept so old calls still work
+    if orders_df is None:
+        orders_df = load_orders()
+    return simulate(scheduler, orders_df, start_time, end_time)
+
+
+# tables shared with sweep workers, set once per worker by _init_worker
+_worker_tables = {}
+
+def _init_worker(hosp_df, orders_df, start_time, end_time):
+    # under fork these are inherited from the parent rather than pickled
+    _worker_tables.update(hosp_df=hosp_df, orders_df=orders_df,
+                          start_time=start_time, end_time=end_time)
+
+def _run_one(task):
+    scheduler_class, params = task
+    scheduler = scheduler_class(_worker_tables["hosp_df"], **params)
+    results = test_scheduler(scheduler, _worker_tables["start_time"],
+                             _worker_tables["end_time"], orders_df=_worker_tables["orders_df"])
+    return dict(scheduler=scheduler_class.__name__, **params, **results)
+
+def run_sweep(scheduler_classes, grid=None, hosp_df=None, orders_df=None,
+              start_time=25640, end_time=71840, processes=None):
+    '''
+    Runs every scheduler class against every combination of the parameters
+    in grid (e.g. {"total_zips": [10, 20], "max_load": [3, 4]}), one
+    simulation per process. Returns a DataFrame with one row per run.
+    '''
+    if hosp_df is None:
+        hosp_df = load_hospitals()
+    if orders_df is None:
+        orders_df = load_orders()
+    grid = grid or {}
+
+    names = list(grid)
+    tasks = [(cls, dict(zip(names, values)))
+             for cls in scheduler_classes
+             for values in product(*(grid[name] for name in names))]
+
+    initargs = (hosp_df, orders_df, start_time, end_time)
+    processes = min(processes or os.cpu_count(), len(tasks))
+    if processes <= 1:
+        _init_worker(*initargs)
+        rows = [_run_one(task) for task in tasks]
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+            rows = pool.map(_run_one, tasks, chunksize=1)
+
+    return pd.DataFrame(rows)
 
 
 if __name__ == '__main__':
-    hosp_df = pd.read_csv("hospitals.csv", names=["hospital_name", "north", "east"])
-    # add base coordinates (0,0) to dataframe
-    hosp_df.loc[len(hosp_df)] = ("base", 0, 0)
-    orders_df = pd.read_csv("orders.csv", names=["received_time", "hospital_name", "priority"])
-
-    zs = ZipScheduler(hosp_df=hosp_df)
-    zs_results = test_scheduler(zs)
-
-
-    zs_nextord = ZipScheduler_NextOrd(hosp_df=hosp_df)
-    zs_nextord_results = test_scheduler(zs_nextord)
+    hosp_df = load_hospitals()
+    orders_df = load_orders()
 
-
-    zs_greedy = ZipScheduler_Greedy(hosp_df=hosp_df)
-    zs_greedy_results = test_scheduler(zs_greedy)
-
-
-    zs_sp = ZipScheduler_SP(hosp_df=hosp_df)
-    zs_sp_results = test_scheduler(zs_sp)
+    schedulers = [ZipScheduler, ZipScheduler_NextOrd, ZipScheduler_Greedy, ZipScheduler_SP]
+    results_df = run_sweep(schedulers, hosp_df=hosp_df, orders_df=orders_df)
+    if len(sys.argv) > 1:
+        save_results(results_df, sys.argv[1])
+    results = results_df.to_dict("records")
 
     scheduler_types = ["Regular Scheduler (prioritizes delivery to same place)",
                        "Scheduler that just takes next in range",
                        "Greedy Scheduler",
                        "Scheduler with Shortest Path"]
 
-    results = [zs_results, zs_nextord_results, zs_greedy_results, zs_sp_results]
-
     for i in range(len(results)):
         print("\n Results for", scheduler_types[i])
         print("Number of times a zip was unavailable: ", results[i]["count_unavailable"])
-        print("Mean wait time for emergency (seconds): ", results[i]["wait_emergency"])
-        print("Mean wait time for resupply (seconds): ", results[i]["wait_resupply"])
-        print("Mean flight time for delivery (seconds): ", results[i]["flight_time"])
+        for name, label in [("wait_emergency", "wait time for emergency"),
+                            ("wait_resupply", "wait time for resupply"),
+                            ("flight_time", "flight time per flight")]:
+            print("Mean {} (seconds): ".format(label), results[i][name])
+            print("  p50/p95/p99: ", [results[i]["{}_p{}".format(name, q)] for q in (50, 95, 99)])
+        print("Zip utilization: ", results[i]["utilization"])
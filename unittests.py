@@ -2,12 +2,31 @@
 Unit tests for various methods in different classes.
 
 '''
+import os
+import json
+import pickle
+import tempfile
+import asyncio
+import threading
+import warnings
 import unittest
 import numpy as np
 import pandas as pd
 from itertools import permutations
-from zipline import Zip, ZipScheduler
+from zipline import Zip, ZipScheduler, Fleet, Priority, FlightStatus, load_hospitals, load_orders
 from schedulers import ZipScheduler_Greedy, ZipScheduler_SP, ZipScheduler_NextOrd
+from simulation import simulate
+from ingest import iter_orders, time_ordered, order_batches
+from tester import run_sweep
+import tester
+from benchmarks import compare, synthetic_hospitals
+from workload import generate_hospitals, generate_orders, write_workload, Spike
+from instrument import instrument, uninstrument, MemorySink, JsonlSink
+from service import DispatchService
+import checkpoint
+import zipline
+from depots import DepotCoordinator, simulate_shards
+from metrics import Samples, save_results
 
 def queue_test_orders(scheduler, num):
     for i in range(num):
@@ -24,23 +43,149 @@ class TestTraveling(unittest.TestCase):
         self.assertEqual(int(zs.hosp_distance("Gitwe", "base")),
                          int(np.sqrt((-18412)**2+(-10076)**2)))
 
+    def test_distance_matrix(self):
+        m = zs.dist_matrix
+        self.assertEqual(m.shape, (len(hosp_df), len(hosp_df)))
+        self.assertTrue(np.allclose(m, m.T))
+        self.assertTrue(np.all(np.diag(m) == 0))
+        # name lookups are views over the matrix
+        self.assertEqual(zs.dists["Gitwe"]["Kabaya"],
+                         m[zs.hosp_index["Gitwe"], zs.hosp_index["Kabaya"]])
+        self.assertEqual(zs.dists["base"]["Kaduha"], zs.hosp_distance("Kaduha", "base"))
+
+    def test_scheduler_own_hospitals(self):
+        # geometry comes from the dataframe the scheduler was given
+        small_df = pd.DataFrame([("A", 3, 4), ("base", 0, 0)],
+                                columns=["hospital_name", "north", "east"])
+        zsmall = ZipScheduler(hosp_df = small_df)
+        self.assertEqual(zsmall.hosp_distance("A", "base"), 5)
+        self.assertEqual(zsmall.route_distance({"hospital": "A"}), 10)
+
+    def test_load_cached(self):
+        # second load comes from the cache and is an independent copy
+        first = load_hospitals()
+        second = load_hospitals()
+        self.assertTrue(first.equals(second))
+        self.assertIsNot(first, second)
+        self.assertEqual(second["hospital_name"].iloc[-1], "base")
+
+    def test_load_bad_cache(self):
+        # an unreadable cache file falls back to the csv, then gets rewritten
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "hospitals.csv")
+            hosp_df[hosp_df["hospital_name"] != "base"].to_csv(path, header=False, index=False)
+            with open(path + ".cache.npz", "wb") as f:
+                f.write(b"not an archive")
+            first = load_hospitals(path)
+            self.assertTrue(first.equals(hosp_df))
+            zipline._table_cache.clear()
+            second = load_hospitals(path)
+            self.assertTrue(second.equals(first))
+
+    def test_load_missing_values(self):
+        # a blank priority loads as NaN from the csv and from the cache alike
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "orders.csv")
+            with open(path, "w") as f:
+                f.write("1,Gitwe,Emergency\n2,Kaduha,\n")
+            first = load_orders(path)
+            zipline._table_cache.clear()
+            second = load_orders(path)
+            self.assertTrue(os.path.exists(path + ".cache.npz"))
+        self.assertTrue(pd.isna(first["priority"][1]))
+        self.assertTrue(second.equals(first))
+        self.assertEqual(second["priority"].dtype, object)
+
     def test_zip_dispatch(self):
         self.assertEqual(zs.send_zip(30000, 300), 30010)
         self.assertEqual(zs.zips_available(30002), 9)
         self.assertEqual(zs.zips_available(30030), 10)
 
+    def test_fleet(self):
+        fleet = Fleet([Zip() for i in range(3)])
+        self.assertEqual(fleet.next_free_time(0), None)
+        self.assertEqual(fleet.dispatch(0, 300), 10)
+        self.assertEqual(fleet.dispatch(0, 150), 5)
+        self.assertEqual(fleet.available(1), 1)
+        # earliest return comes first, whatever the dispatch order
+        self.assertEqual(fleet.next_free_time(1), 5)
+        self.assertEqual(fleet.available(5), 2)
+        self.assertEqual(fleet.next_free_time(5), 10)
+        self.assertEqual(fleet.dispatch(5, 30), 6)
+        self.assertEqual(fleet.dispatch(5, 30), 6)
+        self.assertEqual(fleet.dispatch(5, 30), None)
+        self.assertEqual(fleet.available(10), 3)
+
     def test_queue(self):
         zs.queue_order(20000, "Gitwe", "Resupply")
         zs.queue_order(30000, "Kaduha", "Emergency")
-        self.assertEqual(zs.resupply.pop(), {"received_time": 20000,
-                                             "hospital": "Gitwe",
-                                             "priority": "Resupply"})
-        self.assertEqual(zs.emergency.pop(), {"received_time": 30000,
-                                              "hospital": "Kaduha",
-                                              "priority": "Emergency"})
+        resupply = zs.resupply.pop()
+        emergency = zs.emergency.pop()
+        self.assertEqual((resupply["received_time"], resupply["hospital"], resupply["priority"]),
+                         (20000, "Gitwe", "Resupply"))
+        self.assertEqual((emergency["received_time"], emergency["hospital"], emergency["priority"]),
+                         (30000, "Kaduha", "Emergency"))
         self.assertFalse(zs.resupply)
         self.assertFalse(zs.emergency)
 
+    def test_order_records(self):
+        zsq = ZipScheduler(hosp_df = hosp_df)
+        zsq.queue_order(5, " Gitwe", " Emergency")
+        order = zsq.emergency[0]
+        self.assertFalse(hasattr(order, "__dict__"))
+        self.assertFalse(hasattr(zsq.ZipList[0], "__dict__"))
+        # still readable like the old dicts
+        self.assertEqual(order["hospital"], "Gitwe")
+        self.assertEqual(order["priority"], "Emergency")
+        self.assertIs(order.priority, Priority.EMERGENCY)
+        self.assertEqual(order.hospital_id, zsq.hosp_index["Gitwe"])
+        with self.assertRaises(KeyError):
+            order["missing"]
+        wait = zsq.schedule_next_flight(65)[1][0]
+        self.assertEqual((wait["priority"], wait["wait"]), ("Emergency", 60))
+
+    def test_find_in_range(self):
+        # same answer as scanning the queue in order, for many partial routes
+        rng = np.random.default_rng(0)
+        hosps = generate_hospitals(60, seed = 0, radius = 90000)
+        zsf = ZipScheduler(hosp_df = hosps)
+        names = list(hosps["hospital_name"][:-1])
+        for i in range(300):
+            zsf.queue_order(i, names[rng.integers(len(names))], "Resupply")
+        queue = zsf.resupply
+        for _ in range(50):
+            args = [{"hospital": names[j]} for j in rng.integers(len(names), size=rng.integers(3))]
+            expected = next((o for o in queue
+                             if zsf.route_distance(*args, o) < zsf.max_range), None)
+            self.assertIs(zsf.find_in_range(queue, zsf.partial_route(*args)), expected)
+
+    def test_find_in_range_max_range(self):
+        # a max_range changed after construction applies past the first
+        # scan_limit orders too: Kigeme was reachable, now only Gitwe is
+        zsf = ZipScheduler(hosp_df = hosp_df)
+        for i in range(zsf.scan_limit + 1):
+            zsf.queue_order(i, "Kigeme", "Resupply")
+        zsf.queue_order(20, "Gitwe", "Resupply")
+        zsf.max_range = 60000
+        self.assertEqual(zsf.find_in_range(zsf.resupply, zsf.partial_route())["hospital"], "Gitwe")
+
+    def test_order_queue(self):
+        zsq = ZipScheduler(hosp_df = hosp_df)
+        zsq.queue_order(1, "Gitwe", "Emergency")
+        zsq.queue_order(1, "Gitwe", "Emergency")
+        zsq.queue_order(2, "Kaduha", "Emergency")
+        zsq.queue_order(3, "Gitwe", "Emergency")
+        q = zsq.emergency
+        self.assertEqual([o["order_id"] for o in q.by_hospital["Gitwe"].values()], [0, 1, 3])
+        # identical orders are removed one at a time
+        zsq.q_remove(q, q[0])
+        self.assertEqual(len(q), 3)
+        self.assertEqual(q.first_at("Gitwe")["order_id"], 1)
+        q.remove(q.first_at("Kaduha"))
+        self.assertEqual(q.first_at("Kaduha"), None)
+        # arrival order is kept
+        self.assertEqual([o["received_time"] for o in q], [1, 3])
+
     def test_scheduler_greedy(self):
         zsg = ZipScheduler_Greedy(hosp_df = hosp_df)
         # queue orders - we know that it will take Gitwe first b.c. its closest
@@ -56,6 +201,20 @@ class TestTraveling(unittest.TestCase):
         self.assertEqual([h["hospital"] for h in zsg.schedule_next_flight(5)[0]],
                         ["Gitwe", "Kaduha", "Kigeme"])
 
+    def test_partial_route(self):
+        zsg = ZipScheduler_Greedy(hosp_df = hosp_df)
+        hosps = ["Kigeme", "Kabaya", "Kaduha", "Gitwe"]
+        idx = np.array([zsg.hosp_index[h] for h in hosps])
+        route = zsg.partial_route()
+        self.assertEqual(route.total(), 0)
+        for h in ["Gitwe", "Kaduha", "Kabaya"]:
+            for i, dist in zip(idx, route.with_stops(idx)):
+                self.assertAlmostEqual(route.with_stop(i), dist)
+                self.assertAlmostEqual(dist, zsg.route_distance(*route, {"hospital": zsg.dists.names[i]}))
+            route.append({"hospital": h})
+            self.assertAlmostEqual(route.total(), zsg.route_distance(*route))
+        self.assertEqual([o["hospital"] for o in route], ["Gitwe", "Kaduha", "Kabaya"])
+
     def test_scheduler_sp(self):
         zs_sp = ZipScheduler_SP(hosp_df = hosp_df)
         zs_sp.queue_order(1, "Kigeme", "Emergency")
@@ -69,25 +228,50 @@ class TestTraveling(unittest.TestCase):
                          zs_sp.shortest_path({"hospital": "Kaduha"},
                                              {"hospital": "Kigeme"},
                                              {"hospital": "Gitwe"})[1])
+
+    def test_scheduler_sp_exact(self):
+        zs_sp = ZipScheduler_SP(hosp_df = hosp_df, route_cache_size = 2)
+        hosps = ["Kigeme", "Kabaya", "Kaduha", "Gitwe", "Kabgayi", "Ruhango"]
+        orders = [{"hospital": h} for h in hosps]
+        best = min(zs_sp.route_distance(*p) for p in permutations(orders))
+        route, length = zs_sp.shortest_path(*orders)
+        self.assertAlmostEqual(length, best)
+        self.assertAlmostEqual(zs_sp.route_distance(*route), best)
+        # held-karp agrees with brute force
+        key = tuple(sorted(zs_sp.hosp_index[h] for h in hosps))
+        self.assertAlmostEqual(zs_sp.solve_held_karp(key)[1], best)
+        # repeated hospital sets come from the cache, which stays bounded
+        self.assertIn(key, zs_sp.route_cache)
+        zs_sp.shortest_path(*orders[:3])
+        zs_sp.shortest_path(*orders[3:])
+        self.assertEqual(len(zs_sp.route_cache), 2)
+        self.assertNotIn(key, zs_sp.route_cache)
+
     def test_scheduler_regular(self):
         zsr = ZipScheduler(hosp_df = hosp_df)
         queue_test_orders(zsr, 10)
         # takes first
         self.assertEqual(zsr.schedule_next_flight(50000)[0][0]["hospital"], "Gitwe")
         # if we empty the emergency list, resupplies are considered
-        zsr.emergency = []
+        zsr.emergency.clear()
         self.assertEqual(zsr.schedule_next_flight(50000)[0][0]["priority"], "Resupply")
         # queue 1 emergency; order will be emergency/resupply/resupply
         zsr.queue_order(1, "Kigeme", "Emergency")
         self.assertEqual([h["priority"] for h in zsr.schedule_next_flight(50000)[0]],
                         ["Emergency", "Resupply", "Resupply"])
-        zsr.emergency = []
-        zsr.resupply = []
+        zsr.emergency.clear()
+        zsr.resupply.clear()
         zsr.queue_order(70000, "Kigeme", "Emergency")
         self.assertEqual(zs.find_next(zs.emergency, []), (None, []))
         self.assertEqual(zs.find_orders(), None)
         self.assertEqual(len(zsr.schedule_next_flight(75000)[0]), 1)
 
+        # decisions that launch nothing say why
+        self.assertTrue(zsr.schedule_next_flight(75000).launched is False)
+        self.assertEqual(zsr.schedule_next_flight(75000).status, FlightStatus.NO_ORDERS)
+        busy = ZipScheduler(hosp_df = hosp_df, total_zips = 0)
+        self.assertEqual(busy.schedule_next_flight(75000).status, FlightStatus.NO_ZIP)
+
         # test zips available function
         self.assertEqual(zsr.zips_available(75001), 9)
         self.assertEqual(zsr.zips_available(99001), 10)
@@ -107,14 +291,452 @@ class TestTraveling(unittest.TestCase):
         self.assertEqual([h["hospital"] for h in zs_nextord.schedule_next_flight(5)[0]],
                         ["Kigeme", "Kaduha", "Gitwe"])
 
+class TestBatchDispatch(unittest.TestCase):
+
+    def test_schedule_flights_fills_zips(self):
+        for cls in [ZipScheduler, ZipScheduler_NextOrd, ZipScheduler_Greedy, ZipScheduler_SP]:
+            zsb = cls(hosp_df = hosp_df, total_zips = 3)
+            for h in ["Kigeme", "Kabaya", "Kaduha", "Gitwe", "Kabgayi", "Ruhango", "Kabaya"]:
+                zsb.queue_order(1, h, "Resupply")
+            zsb.queue_order(2, "Kabaya", "Emergency")
+            flights = zsb.schedule_flights(5)
+            self.assertEqual(zsb.zips_available(5), 0)
+            self.assertEqual(len(flights), 3)
+            # the emergency is on the first flight out
+            self.assertIn("Emergency", [o["priority"] for o in flights[0].orders])
+            for flight in flights:
+                self.assertTrue(len(flight.orders) <= zsb.max_load)
+                self.assertTrue(zsb.route_distance(*flight.orders) < zsb.max_range)
+                self.assertAlmostEqual(flight.flight_time*30, zsb.plan_route(zsb.partial_route(*flight.orders))[1])
+            self.assertEqual(sum(len(f.orders) for f in flights) + len(zsb.resupply), 7 + 1)
+
+    def test_rebalance_shortens(self):
+        zsb = ZipScheduler(hosp_df = hosp_df)
+        for h in ["Gitwe", "Kabaya", "Gitwe", "Kabaya"]:
+            zsb.queue_order(1, h, "Resupply")
+        orders = list(zsb.resupply)
+        # each flight goes to both hospitals; swapping sends one zip to each
+        loads = [[orders[0], orders[1]], [orders[3], orders[2]]]
+        before = sum(zsb.route_distance(*l) for l in loads)
+        loads = zsb.rebalance(loads)
+        after = sum(zsb.route_distance(*l) for l in loads)
+        self.assertTrue(after < before)
+        self.assertEqual(sorted(len(set(o["hospital"] for o in l)) for l in loads), [1, 1])
+
+    def test_rebalance_nearby(self):
+        # each flight is only paired with the flights whose stops are closest
+        zsb = ZipScheduler(hosp_df = hosp_df, max_load = 1)
+        zsb.rebalance_neighbors = 2
+        for h in ["Gitwe", "Kaduha", "Kabaya", "Kigeme", "Kabgayi"]:
+            zsb.queue_order(1, h, "Resupply")
+        loads = [[o] for o in zsb.resupply]
+        near = zsb.nearby_loads(loads)
+        for a, partners in enumerate(near):
+            self.assertEqual(len(partners), 2)
+            self.assertNotIn(a, partners)
+            hosp = loads[a][0]["hospital"]
+            others = sorted((zsb.hosp_distance(hosp, l[0]["hospital"]), b)
+                            for b, l in enumerate(loads) if b != a)
+            self.assertEqual(sorted(partners), sorted(b for _, b in others[:2]))
+        rebalanced = zsb.rebalance(loads)
+        self.assertEqual(sorted(o.order_id for l in rebalanced for o in l), list(range(5)))
+
+class TestSimulation(unittest.TestCase):
+
+    def test_simulate_wakes_on_return(self):
+        # one zip, two orders too far apart to share a flight: the second
+        # one leaves exactly when the zip lands
+        zs1 = ZipScheduler(hosp_df = hosp_df, total_zips = 1)
+        orders = pd.DataFrame([(1, "Kigeme", "Emergency"),
+                               (2, "Kabaya", "Emergency")],
+                              columns=["received_time", "hospital_name", "priority"])
+        results = simulate(zs1, orders, start_time = 0, end_time = 100000)
+        first_flight = zs1.route_distance({"hospital": "Kigeme"})/30
+        self.assertEqual(results["count_unavailable"], 1)
+        self.assertAlmostEqual(results["wait_emergency"], (1 + first_flight - 2)/2)
+        self.assertEqual(zs1.ZipList[0].trips_made, 2)
+
+    def test_simulate_launches_multiple(self):
+        # several zips free at once all get used at the same instant
+        zs3 = ZipScheduler(hosp_df = hosp_df, total_zips = 3, max_load = 1)
+        orders = pd.DataFrame([(5, h, "Emergency") for h in ["Gitwe", "Kaduha", "Kigeme"]],
+                              columns=["received_time", "hospital_name", "priority"])
+        results = simulate(zs3, orders, start_time = 0, end_time = 100000)
+        self.assertEqual(results["wait_emergency"], 0)
+        self.assertEqual(sum(z.trips_made for z in zs3.ZipList), 3)
+
+    def test_simulate_streams(self):
+        # the same orders from a DataFrame, csv, jsonl and an iterator
+        orders = orders_df.head(60)
+        expected = simulate(ZipScheduler(hosp_df = hosp_df), orders, 0, 100000)
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "orders.csv")
+            jsonl_path = os.path.join(tmp, "orders.jsonl")
+            orders.to_csv(csv_path, header=False, index=False)
+            with open(jsonl_path, "w") as f:
+                for row in orders.to_dict("records"):
+                    f.write(json.dumps({k: (int(v) if k == "received_time" else v)
+                                        for k, v in row.items()}) + "\n")
+            sources = [csv_path, jsonl_path, iter(orders.values.tolist())]
+            for source in sources:
+                self.assertEqual(simulate(ZipScheduler(hosp_df = hosp_df), source, 0, 100000),
+                                 expected)
+
+    def test_tester_interval(self):
+        # the old positional interval is accepted and ignored
+        old_style = tester.test_scheduler(ZipScheduler(hosp_df = hosp_df), 25640, 71840, 60)
+        self.assertEqual(old_style, tester.test_scheduler(ZipScheduler(hosp_df = hosp_df),
+                                                          orders_df = orders_df))
+
+    def test_time_ordered(self):
+        rows = [(5, "Gitwe", "Emergency"), (3, "Gitwe", "Emergency"),
+                (9, "Gitwe", "Emergency"), (1, "Gitwe", "Emergency")]
+        # 3 is within 2s of 5 and gets reordered, 1 is too late
+        self.assertEqual([o.received_time for o in time_ordered(iter_orders(rows), 2)],
+                         [3, 5, 1, 9])
+        # 1 joins the batch at 5 so time never goes back, but keeps its received_time
+        with self.assertWarns(UserWarning):
+            batches = list(order_batches(iter_orders(rows), 2))
+        self.assertEqual([(t, [o.received_time for o in batch]) for t, batch in batches],
+                         [(3, [3]), (5, [5, 1]), (9, [9])])
+
+    def test_simulate_late_rows(self):
+        # a late row leaves at the current time, not back in the past
+        zs3 = ZipScheduler(hosp_df = hosp_df, total_zips = 4, max_load = 1)
+        rows = [(1, "Gitwe", "Emergency"), (50, "Kaduha", "Emergency"),
+                (60, "Kabaya", "Emergency"), (10, "Kigeme", "Emergency")]
+        launches = []
+        launch = zs3.launch
+        zs3.launch = lambda current_time, route: launches.append(current_time) or launch(current_time, route)
+        with self.assertWarns(UserWarning):
+            results = simulate(zs3, iter(rows), start_time = 0, end_time = 100000)
+        self.assertEqual(launches, [1, 50, 50, 60])
+        # Kigeme's wait counts from when it was placed, not when it was read
+        self.assertEqual(results["wait_emergency"], (50 - 10)/4)
+
+    def test_run_sweep(self):
+        grid = {"total_zips": [1, 5], "max_load": [1, 3]}
+        orders = orders_df.head(40)
+        parallel = run_sweep([ZipScheduler, ZipScheduler_Greedy], grid, hosp_df, orders,
+                             start_time = 0, end_time = 100000, processes = 2)
+        serial = run_sweep([ZipScheduler, ZipScheduler_Greedy], grid, hosp_df, orders,
+                           start_time = 0, end_time = 100000, processes = 1)
+        self.assertEqual(len(parallel), 8)
+        self.assertEqual(list(parallel["scheduler"][:4]), ["ZipScheduler"]*4)
+        pd.testing.assert_frame_equal(parallel, serial)
+
+class TestMetrics(unittest.TestCase):
+
+    def test_samples(self):
+        values = np.random.default_rng(0).exponential(100, size=5000)
+        exact = Samples()
+        bounded = Samples(capacity = 500)
+        for v in values:
+            exact.add(v)
+            bounded.add(v)
+        self.assertEqual(exact.percentiles(), list(np.percentile(values, [50, 95, 99])))
+        # the reservoir stays at capacity, count and mean stay exact
+        self.assertEqual(len(bounded.values), 500)
+        self.assertEqual(len(bounded), 5000)
+        self.assertAlmostEqual(bounded.mean(), values.mean())
+        self.assertEqual(bounded.max, values.max())
+        self.assertTrue(abs(bounded.percentiles()[0] - np.median(values)) < 15)
+        self.assertTrue(np.isnan(Samples().mean()))
+
+    def test_simulate_metrics(self):
+        # one flight with two orders counts one flight time
+        zs1 = ZipScheduler(hosp_df = hosp_df, total_zips = 2)
+        orders = pd.DataFrame([(1, "Gitwe", "Emergency"), (1, "Gitwe", "Resupply")],
+                              columns=["received_time", "hospital_name", "priority"])
+        results = simulate(zs1, orders, start_time = 0, end_time = 100000)
+        flight_time = zs1.route_distance({"hospital": "Gitwe"})/30
+        self.assertEqual(results["flights"], 1)
+        self.assertAlmostEqual(results["flight_time_p99"], flight_time)
+        self.assertAlmostEqual(results["utilization"], flight_time/(2*100000))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "results.csv")
+            save_results(results, path)
+            pd.testing.assert_frame_equal(pd.read_csv(path), pd.DataFrame([results]))
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_compare(self):
+        baseline = [{"key": "a", "seconds": 1.0}, {"key": "b", "seconds": 1.0}]
+        results = [{"key": "a", "seconds": 1.4}, {"key": "b", "seconds": 2.0},
+                   {"key": "new", "seconds": 9.0}]
+        self.assertEqual(compare(results, baseline, 0.5), [("b", 1.0, 2.0)])
+
+    def test_synthetic_hospitals(self):
+        hosps = synthetic_hospitals(50)
+        self.assertEqual(len(hosps), 51)
+        self.assertEqual(ZipScheduler(hosp_df = hosps).dist_matrix.shape, (51, 51))
+
+class TestWorkload(unittest.TestCase):
+
+    def test_seeded_and_ordered(self):
+        hosps = generate_hospitals(30, seed = 3, clusters = 3)
+        self.assertTrue(hosps.equals(generate_hospitals(30, seed = 3, clusters = 3)))
+        orders = list(generate_orders(hosps, days = 2, seed = 3))
+        self.assertEqual(orders, list(generate_orders(hosps, days = 2, seed = 3)))
+        times = [o.received_time for o in orders]
+        self.assertEqual(times, sorted(times))
+        self.assertTrue(0 <= times[0] and times[-1] < 2*86400)
+
+    def test_spike(self):
+        hosps = generate_hospitals(30, seed = 1)
+        spike = Spike(10*3600, 11*3600, rate = 500, hospitals = ["H1"])
+        orders = [o for o in generate_orders(hosps, seed = 1, spikes = [spike])
+                  if 10*3600 <= o.received_time < 11*3600]
+        emergencies = [o for o in orders if o.priority == "Emergency"]
+        self.assertTrue(len(emergencies) > 0.9*len(orders))
+        self.assertTrue(sum(o.hospital_name == "H1" for o in orders) > 400)
+
+    def test_plugs_into_scheduler(self):
+        hosps = generate_hospitals(40, seed = 2)
+        results = simulate(ZipScheduler_Greedy(hosp_df = hosps),
+                           generate_orders(hosps, seed = 2), 0, 86400)
+        self.assertTrue(results["flight_time"] > 0)
+        with tempfile.TemporaryDirectory() as tmp:
+            write_workload(tmp, hosps, generate_orders(hosps, seed = 2))
+            self.assertTrue(load_hospitals(os.path.join(tmp, "hospitals.csv")).equals(hosps))
+            self.assertEqual(len(load_orders(os.path.join(tmp, "orders.csv"))),
+                             len(list(generate_orders(hosps, seed = 2))))
+
+class TestInstrument(unittest.TestCase):
+
+    def test_memory_sink(self):
+        sink = MemorySink()
+        zsi = instrument(ZipScheduler_SP(hosp_df = hosp_df, total_zips = 2), sink)
+        results = simulate(zsi, orders_df, 0, 100000)
+        summary = sink.summary()
+        for name in ["find_orders", "find_next", "find_in_range", "plan_route", "send_zip",
+                     "schedule_next_flight"]:
+            self.assertTrue(summary["timings"][name]["count"] > 0)
+        self.assertEqual(summary["counters"]["rejected.no_zip_available"],
+                         results["count_unavailable"])
+        self.assertEqual(summary["counters"]["send_zip"], summary["counters"]["flights"])
+        self.assertIn("idle_zips", summary["gauges"])
+        # removing the hooks leaves plain methods
+        uninstrument(zsi)
+        self.assertNotIn("find_orders", vars(zsi))
+
+    def test_out_of_range_and_jsonl(self):
+        far_df = pd.DataFrame([("Far", 90000, 0), ("base", 0, 0)],
+                              columns=["hospital_name", "north", "east"])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.jsonl")
+            sink = JsonlSink(path)
+            zsi = instrument(ZipScheduler(hosp_df = far_df), sink)
+            zsi.queue_order(1, "Far", "Emergency")
+            self.assertEqual(zsi.schedule_next_flight(5).status, FlightStatus.NO_ORDERS)
+            sink.close()
+            with open(path) as f:
+                events = [json.loads(line) for line in f]
+        self.assertIn({"type": "count", "name": "rejected.out_of_range", "value": 1}, events)
+
+class TestService(unittest.TestCase):
+
+    def test_wakes_on_return(self):
+        # one fast zip, two orders too far apart to share: the second flight
+        # leaves once the zip is back, without any polling
+        async def scenario():
+            service = DispatchService(ZipScheduler(hosp_df = hosp_df, total_zips = 1,
+                                                   flight_speed = 2000000))
+            flights = service.subscribe()
+            runner = asyncio.ensure_future(service.run())
+            service.submit("Kigeme", "Emergency")
+            first = await asyncio.wait_for(flights.get(), 1)
+            service.submit("Kabaya", "Emergency")
+            second = await asyncio.wait_for(flights.get(), 1)
+            service.stop()
+            await runner
+            return first, second
+        first, second = asyncio.run(scenario())
+        self.assertEqual([o["hospital"] for o in first.orders], ["Kigeme"])
+        self.assertEqual([o["hospital"] for o in second.orders], ["Kabaya"])
+
+    def test_executor_shutdown(self):
+        # the worker thread the service started is gone once run ends
+        async def scenario():
+            service = DispatchService(ZipScheduler(hosp_df = hosp_df))
+            runner = asyncio.ensure_future(service.run())
+            flights = service.subscribe()
+            service.submit("Gitwe", "Emergency")
+            await asyncio.wait_for(flights.get(), 1)
+            executor = service.executor
+            service.stop()
+            await runner
+            return service, executor
+        before = set(threading.enumerate())
+        service, executor = asyncio.run(scenario())
+        self.assertIsNone(service.executor)
+        for thread in set(threading.enumerate()) - before:
+            thread.join(1)
+        self.assertEqual(set(threading.enumerate()), before)
+        with self.assertRaises(RuntimeError):
+            executor.submit(print)
+
+    def test_socket_client(self):
+        async def scenario():
+            service = DispatchService(ZipScheduler(hosp_df = hosp_df))
+            runner = asyncio.ensure_future(service.run())
+            server = await service.serve()
+            port = server.sockets[0].getsockname()[1]
+
+            sub_reader, sub_writer = await asyncio.open_connection("127.0.0.1", port)
+            sub_writer.write(b'{"subscribe": true}\n')
+            await sub_writer.drain()
+            while not service.subscribers:
+                await asyncio.sleep(0.001)
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            replies = []
+            for request in [{"hospital": "Nowhere", "priority": "Emergency"},
+                            {"hospital": "Gitwe", "priority": "Emergency"}]:
+                writer.write((json.dumps(request) + "\n").encode())
+                await writer.drain()
+                replies.append(json.loads(await reader.readline()))
+            flight = json.loads(await asyncio.wait_for(sub_reader.readline(), 1))
+
+            writer.close()
+            sub_writer.close()
+            while service.subscribers:
+                await asyncio.sleep(0.001)
+            server.close()
+            await server.wait_closed()
+            service.stop()
+            await runner
+            return replies, flight
+        replies, flight = asyncio.run(scenario())
+        self.assertEqual([r["status"] for r in replies], ["error", "queued"])
+        self.assertEqual(flight["orders"][0]["hospital"], "Gitwe")
+
+class TestCheckpoint(unittest.TestCase):
+
+    def run_rest(self, scheduler, start, end=100000):
+        return simulate(scheduler, orders_df, start, end)
+
+    def test_restore_continues_identically(self):
+        # replay to mid-day, snapshot, and check both copies carry on the same
+        zs_a = ZipScheduler_SP(hosp_df = hosp_df, total_zips = 3)
+        simulate(zs_a, orders_df, 0, 40000)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "mid.npz")
+            checkpoint.save(zs_a, path)
+            zs_b = checkpoint.load(path)
+        self.assertIsInstance(zs_b, ZipScheduler_SP)
+        self.assertEqual([o.order_id for o in zs_b.emergency], [o.order_id for o in zs_a.emergency])
+        self.assertEqual([z.trips_made for z in zs_b.ZipList], [z.trips_made for z in zs_a.ZipList])
+        self.assertTrue(np.array_equal(zs_b.dist_matrix, zs_a.dist_matrix))
+        self.assertEqual(self.run_rest(zs_b, 40000), self.run_rest(zs_a, 40000))
+
+    def test_fork(self):
+        zs_a = ZipScheduler(hosp_df = hosp_df, total_zips = 2)
+        simulate(zs_a, orders_df, 0, 40000)
+        snap = checkpoint.snapshot(zs_a)
+        forks = checkpoint.fork(snap, [ZipScheduler_Greedy, ZipScheduler_NextOrd])
+        self.assertEqual([type(f) for f in forks], [ZipScheduler_Greedy, ZipScheduler_NextOrd])
+        # forks are independent of each other and of the original
+        self.run_rest(forks[0], 40000)
+        self.assertEqual(len(forks[1].resupply), len(zs_a.resupply))
+        self.assertEqual(forks[1].next_free_time(40000), zs_a.next_free_time(40000))
+
+    def test_next_order_id(self):
+        # ids carry on from the snapshot, and snapshot leaves the original's alone
+        zs_a = ZipScheduler(hosp_df = hosp_df)
+        for h in ["Gitwe", "Kaduha"]:
+            zs_a.queue_order(1, h, "Resupply")
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            zs_b = checkpoint.restore(checkpoint.snapshot(zs_a))
+        for zs in [zs_a, zs_b]:
+            zs.queue_order(2, "Kigeme", "Resupply")
+            self.assertEqual([o.order_id for o in zs.resupply], [0, 1, 2])
+
+class TestDepots(unittest.TestCase):
+
+    depots = {"base": (0, 0), "west": (-50000, -5000)}
+
+    def test_assignment_and_overflow(self):
+        dc = DepotCoordinator(hosp_df, self.depots, total_zips = {"base": 2, "west": 0})
+        self.assertEqual(dc.depot_order["Kigeme"][0], "west")
+        self.assertEqual(dc.depot_order["Kabaya"], ["base"])
+        self.assertEqual(dc.shards["west"].base_name, "west")
+        # distances from the west depot, not (0,0)
+        self.assertEqual(dc.shards["west"].route_distance({"hospital": "Kigeme"}),
+                         2*dc.shards["west"].dists["west"]["Kigeme"])
+
+        dc.queue_order(1, "Kigeme", "Emergency")
+        self.assertEqual(len(dc.shards["west"].emergency), 1)
+        # west has no zips, so the order goes out from base
+        flights = dc.schedule_flights(5)
+        self.assertEqual([o["hospital"] for f in flights for o in f.orders], ["Kigeme"])
+        self.assertEqual(dc.emergency, 0)
+        self.assertEqual(dc.zips_available(5), 1)
+
+    def test_simulate_network_and_shards(self):
+        dc = DepotCoordinator(hosp_df, self.depots, ZipScheduler_Greedy, total_zips = 3)
+        results = simulate(dc, orders_df, 0, 100000, batch = True)
+        self.assertTrue(results["flight_time"] > 0)
+        with self.assertRaises(TypeError):
+            simulate(dc, orders_df, 0, 100000)
+        dc = DepotCoordinator(hosp_df, self.depots, ZipScheduler_Greedy, total_zips = 3)
+        parallel = simulate_shards(dc, orders_df, 0, 100000, processes = 2)
+        serial = simulate_shards(dc, orders_df, 0, 100000, processes = 1)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(set(parallel), {"base", "west"})
+
+    def test_overflow_emergency_first(self):
+        # west's zip is out; base's only zip takes west's emergency, not its own resupply
+        dc = DepotCoordinator(hosp_df, self.depots, total_zips = 1, max_load = 1)
+        dc.shards["west"].send_zip(0, 100000)
+        dc.queue_order(1, "Kigeme", "Emergency")
+        dc.queue_order(1, "Kabaya", "Resupply")
+        flights = dc.schedule_flights(5)
+        self.assertEqual([(o["hospital"], o["priority"]) for f in flights for o in f.orders],
+                         [("Kigeme", "Emergency")])
+        self.assertEqual((dc.emergency, dc.resupply), (0, 1))
+
+    def test_overflow_keeps_fifo(self):
+        # an older order moved from west waits ahead of newer orders at base
+        dc = DepotCoordinator(hosp_df, self.depots, total_zips = {"base": 1, "west": 0},
+                              max_load = 1)
+        dc.queue_order(1, "Kigeme", "Resupply")
+        dc.queue_order(5, "Gitwe", "Resupply")
+        dc.queue_order(9, "Kabaya", "Resupply")
+        dc.overflow(20)
+        self.assertEqual([o["hospital"] for o in dc.shards["base"].resupply],
+                         ["Kigeme", "Gitwe", "Kabaya"])
+        flights = dc.schedule_flights(20)
+        self.assertEqual([o["hospital"] for f in flights for o in f.orders], ["Kigeme"])
+
+    def test_wake_for_busy_depot(self):
+        # Kabaya is only reachable from base; west's idle zip can't take the
+        # second order, so the simulation must wake when base's zip lands
+        dc = DepotCoordinator(hosp_df, self.depots, total_zips = 1, max_load = 1)
+        orders = pd.DataFrame([(1, "Kabaya", "Emergency"), (1, "Kabaya", "Emergency")],
+                              columns=["received_time", "hospital_name", "priority"])
+        results = simulate(dc, orders, 0, 100000, batch = True)
+        self.assertEqual(results["flights"], 2)
+        self.assertEqual(results["count_unavailable"], 1)
+        self.assertEqual(dc.emergency, 0)
+
+    def test_shared_order_ids(self):
+        dc = DepotCoordinator(hosp_df, self.depots)
+        for h in ["Kigeme", "Kabaya", "Kigeme"]:
+            dc.queue_order(1, h, "Resupply")
+        self.assertEqual([o.order_id for o in dc.shards["west"].resupply], [0, 2])
+        self.assertEqual([o.order_id for o in dc.shards["base"].resupply], [1])
+        # shards go to worker processes as pickles
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            shards = pickle.loads(pickle.dumps(dc.shards))
+        self.assertEqual([o.order_id for o in shards["west"].resupply], [0, 2])
+
 if __name__ == '__main__':
-        # read in hospitals
-    hosp_df = pd.read_csv("hospitals.csv",
-                          names=["hospital_name", "north", "east"])
-    # add base coordinates (0,0) to dataframe
-    hosp_df.loc[len(hosp_df)] = ("base", 0, 0)
-    orders_df = pd.read_csv("orders.csv",
-                            names=["received_time", "hospital_name", "priority"])
+    # read in hospitals (with base at (0,0)) and orders
+    hosp_df = load_hospitals()
+    orders_df = load_orders()
 
     zs = ZipScheduler(hosp_df = hosp_df)
     unittest.main()
@@ -0,0 +1,138 @@
+'''
+Seeded synthetic workloads for scale testing the schedulers.
+
+generate_hospitals lays out hospitals (optionally in clusters) around base,
+generate_orders lazily streams orders from a Poisson process whose rate
+changes by hour of day, with optional emergency spikes. Both plug straight
+into the scheduler constructors and tester.test_scheduler:
+
+    hosp_df = generate_hospitals(200, clusters=5, seed=1)
+    orders = generate_orders(hosp_df, days=30, seed=1)
+    test_scheduler(ZipScheduler(hosp_df), 0, 30*86400, orders_df=orders)
+
+Run as a script to write hospitals.csv/orders.csv in the usual format.
+
+'''
+import os
+import argparse
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from zipline import Priority
+from ingest import OrderRow
+
+DAY = 86400
+HOUR = 3600
+
+# orders per hour for each hour of the day: quiet nights, a daytime peak
+DEFAULT_HOURLY_RATES = [2, 1, 1, 1, 1, 2, 4, 8, 12, 14, 15, 15,
+                        14, 14, 15, 15, 14, 12, 10, 8, 6, 4, 3, 2]
+
+# extra orders/hour between start and end (seconds from the first day),
+# mostly emergencies, optionally aimed at a few hospitals
+Spike = namedtuple("Spike", ["start", "end", "rate", "emergency_fraction", "hospitals"])
+Spike.__new__.__defaults__ = (1.0, None)
+
+
+def generate_hospitals(n, seed=0, radius=60000, clusters=0, cluster_spread=8000):
+    """
+    n hospitals within radius of base, plus base at (0,0). With clusters,
+    hospitals are drawn around that many random centres instead of
+    uniformly over the disc.
+    """
+    rng = np.random.default_rng(seed)
+
+    if clusters:
+        r = radius*np.sqrt(rng.random(clusters))
+        theta = 2*np.pi*rng.random(clusters)
+        centres = np.column_stack([r*np.cos(theta), r*np.sin(theta)])
+        points = centres[rng.integers(0, clusters, n)] + rng.normal(0, cluster_spread, (n, 2))
+    else:
+        r = radius*np.sqrt(rng.random(n))
+        theta = 2*np.pi*rng.random(n)
+        points = np.column_stack([r*np.cos(theta), r*np.sin(theta)])
+
+    hosp_df = pd.DataFrame({"hospital_name": ["H%d" % i for i in range(n)],
+                            "north": points[:, 0].round().astype(int),
+                            "east": points[:, 1].round().astype(int)})
+    hosp_df.loc[len(hosp_df)] = ("base", 0, 0)
+    return hosp_df
+
+
+def _segments(days, hourly_rates, spikes):
+    # split time at hour and spike boundaries; rates are constant inside each piece
+    bounds = {h*HOUR for h in range(days*24 + 1)}
+    for spike in spikes:
+        bounds.update(t for t in (spike.start, spike.end) if 0 < t < days*DAY)
+    bounds = sorted(bounds)
+    for start, end in zip(bounds, bounds[1:]):
+        yield start, end, hourly_rates[(start//HOUR) % 24], [s for s in spikes
+                                                            if s.start <= start and end <= s.end]
+
+
+def generate_orders(hosp_df, days=1, seed=0, hourly_rates=DEFAULT_HOURLY_RATES,
+                    emergency_fraction=1/3, spikes=(), weights=None):
+    """
+    Yields OrderRows in time order, one hour-sized piece at a time, so
+    streams of millions of orders never sit in memory. weights gives the
+    relative share of orders per hospital (uniform by default).
+    """
+    rng = np.random.default_rng(seed)
+    names = hosp_df["hospital_name"][hosp_df["hospital_name"] != "base"].to_numpy()
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)/np.sum(weights)
+
+    for start, end, rate, active in _segments(days, hourly_rates, list(spikes)):
+        # background orders plus one batch per active spike
+        parts = [(rate, emergency_fraction, names, weights)]
+        parts += [(s.rate, s.emergency_fraction, np.asarray(s.hospitals or names), None)
+                  for s in active]
+
+        times, hospitals, emergency = [], [], []
+        for part_rate, part_emergency, part_names, part_weights in parts:
+            n = rng.poisson(part_rate*(end - start)/HOUR)
+            times.append(rng.integers(start, end, n))
+            hospitals.append(rng.choice(part_names, n, p=part_weights))
+            emergency.append(rng.random(n) < part_emergency)
+
+        times = np.concatenate(times)
+        order = np.argsort(times, kind="stable")
+        hospitals = np.concatenate(hospitals)[order]
+        emergency = np.concatenate(emergency)[order]
+        for t, h, e in zip(times[order].tolist(), hospitals.tolist(), emergency.tolist()):
+            yield OrderRow(t, h, Priority.EMERGENCY.value if e else Priority.RESUPPLY.value)
+
+
+def write_workload(out_dir, hosp_df, orders, chunksize=100000):
+    # hospitals.csv (without base) and orders.csv, written in chunks
+    os.makedirs(out_dir, exist_ok=True)
+    hosp_df[hosp_df["hospital_name"] != "base"].to_csv(
+        os.path.join(out_dir, "hospitals.csv"), header=False, index=False)
+
+    with open(os.path.join(out_dir, "orders.csv"), "w") as f:
+        chunk = []
+        for order in orders:
+            chunk.append("%d,%s,%s\n" % order)
+            if len(chunk) >= chunksize:
+                f.writelines(chunk)
+                chunk = []
+        f.writelines(chunk)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic hospitals.csv/orders.csv")
+    parser.add_argument("out_dir")
+    parser.add_argument("--hospitals", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=0)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--rate-scale", type=float, default=1.0,
+                        help="multiply the default hourly order rates")
+    parser.add_argument("--emergency-fraction", type=float, default=1/3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    hosp_df = generate_hospitals(args.hospitals, seed=args.seed, clusters=args.clusters)
+    orders = generate_orders(hosp_df, days=args.days, seed=args.seed,
+                             hourly_rates=[r*args.rate_scale for r in DEFAULT_HOURLY_RATES],
+                             emergency_fraction=args.emergency_fraction)
+    write_workload(args.out_dir, hosp_df, orders)
@@ -5,13 +5,170 @@ Implements the default classes, Zip and ZipScheduler.
 
 '''
 
+import os
+import heapq
+from collections import OrderedDict, namedtuple
+from enum import Enum, IntEnum
+from itertools import islice
 import pandas as pd
 import numpy as np
 
-hosp_df = pd.read_csv("hospitals.csv", names=["hospital_name", "north", "east"])
-# add base coordinates (0,0) to dataframe
-hosp_df.loc[len(hosp_df)] = ("base", 0, 0)
-orders_df = pd.read_csv("orders.csv", names=["received_time", "hospital_name", "priority"])
+HOSPITAL_COLUMNS = ["hospital_name", "north", "east"]
+ORDER_COLUMNS = ["received_time", "hospital_name", "priority"]
+
+
+class FlightStatus(IntEnum):
+    LAUNCHED = 0
+    NO_ZIP = 1       # orders may be waiting, every zip is out
+    NO_ORDERS = 2    # nothing queued, or nothing within range
+
+
+class FlightResult(namedtuple("FlightResult", ["orders", "wait_times", "flight_time", "status"])):
+    """
+    Outcome of a scheduling decision. For launched flights: orders in
+    delivery order, their WaitRecords and seconds in the air.
+    """
+    __slots__ = ()
+
+    @property
+    def launched(self):
+        return self.status is FlightStatus.LAUNCHED
+
+
+# shared results for decisions that launch nothing
+NO_ZIP = FlightResult((), (), 0.0, FlightStatus.NO_ZIP)
+NO_ORDERS = FlightResult((), (), 0.0, FlightStatus.NO_ORDERS)
+
+# bumped when the cache layout changes, so older cache files are re-read from the csv
+TABLE_CACHE_VERSION = 2
+
+# parsed tables, keyed by absolute path -> (mtime, dataframe)
+_table_cache = {}
+
+
+def _table_columns(df, names):
+    # df's columns as arrays np.savez can store without pickle; text columns
+    # also get a mask of missing values. None if a column holds mixed types
+    columns = {}
+    for name in names:
+        values = df[name].to_numpy()
+        if values.dtype == object:
+            missing = pd.isna(values)
+            if not all(isinstance(v, str) for v in values[~missing]):
+                return None
+            columns["na_" + name] = missing
+            values = np.where(missing, "", values).astype(str)
+        columns["col_" + name] = values
+    return columns
+
+
+def _load_table(path, names):
+    # read a headerless csv, reusing a saved copy of its columns if the csv hasn't changed
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+
+    cached = _table_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1].copy()
+
+    # columns as plain arrays, loaded without pickle
+    cache_path = path + ".cache.npz"
+    df = None
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            if (int(data["version"]) == TABLE_CACHE_VERSION and int(data["mtime"]) == mtime
+                    and data["names"].tolist() == names):
+                df = pd.DataFrame({name: data["col_" + name] for name in names})
+                for name in names:
+                    if "na_" + name in data.files:
+                        column = df[name].to_numpy(dtype=object)
+                        column[data["na_" + name]] = np.nan
+                        df[name] = column
+    except Exception:
+        # missing, stale or unreadable cache, fall back to the csv
+        df = None
+
+    if df is None:
+        df = pd.read_csv(path, names=names)
+        columns = _table_columns(df, names)
+        try:
+            if columns is not None:
+                with open(cache_path, "wb") as f:
+                    np.savez(f, version=TABLE_CACHE_VERSION, mtime=np.int64(mtime),
+                             names=np.array(names), **columns)
+        except OSError:
+            # read-only data directory, just keep the in-process copy
+            pass
+
+    _table_cache[path] = (mtime, df)
+    return df.copy()
+
+
+def load_hospitals(path="hospitals.csv"):
+    # hospitals plus the base at (0,0)
+    hosp_df = _load_table(path, HOSPITAL_COLUMNS)
+    hosp_df.loc[len(hosp_df)] = ("base", 0, 0)
+    return hosp_df
+
+
+def load_orders(path="orders.csv"):
+    return _load_table(path, ORDER_COLUMNS)
+
+
+class Priority(str, Enum):
+    """
+    Order priority. Members compare equal to the strings used in orders.csv.
+    """
+    EMERGENCY = "Emergency"
+    RESUPPLY = "Resupply"
+
+
+class Record:
+    """
+    Base for slotted records that can still be read like the dicts they
+    replaced, e.g. order["hospital"].
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self):
+        fields = ", ".join("%s=%r" % (k, getattr(self, k)) for k in self.__slots__)
+        return "%s(%s)" % (type(self).__name__, fields)
+
+
+class Order(Record):
+    """
+    A queued order. hospital_id indexes the scheduler's distance matrix,
+    hospital is the shared name string for that row.
+    """
+    __slots__ = ("order_id", "received_time", "hospital", "hospital_id", "priority")
+
+    def __init__(self, order_id, received_time, hospital, hospital_id, priority):
+        self.order_id = order_id
+        self.received_time = received_time
+        self.hospital = hospital
+        self.hospital_id = hospital_id
+        self.priority = priority
+
+
+class WaitRecord(Record):
+    """
+    How long a delivered order waited before its flight left.
+    """
+    __slots__ = ("priority", "wait")
+
+    def __init__(self, priority, wait):
+        self.priority = priority
+        self.wait = wait
+
 
 class Zip:
     """
@@ -22,6 +179,7 @@ class Zip:
     dispatch - dispatches an order
     update_status - updates whether zip is at base at the current time
     """
+    __slots__ = ("flight_speed", "at_base", "leaving_time", "return_time", "trips_made")
 
     def __init__(self, flight_speed = 30):
         self.flight_speed = flight_speed
@@ -44,155 +202,474 @@ class Zip:
         else:
             self.at_base = False
 
+class OrderQueue:
+    """
+    A FIFO queue of orders with an index by hospital.
+
+    Orders are keyed on their order_id, so removing one is O(1) and two
+    identical-looking orders stay distinct. Iterating yields orders in
+    the order they were received.
+
+    Methods
+    ------
+    append - adds an order to the back of the queue
+    insert - adds an order in line by its received_time
+    remove - removes an order (by its order_id)
+    first_at - earliest queued order for a hospital, or None
+    first_of - earliest queued order for any of several hospitals, or None
+    pop - removes and returns the newest order
+    """
+
+    def __init__(self, orders=()):
+        self.orders = OrderedDict()
+        self.by_hospital = {}
+        # order_id -> place in line, to compare orders across hospitals
+        self.position = {}
+        self.appended = 0
+        for order in orders:
+            self.append(order)
+
+    def append(self, order):
+        self.orders[order.order_id] = order
+        self.by_hospital.setdefault(order.hospital, OrderedDict())[order.order_id] = order
+        self.position[order.order_id] = self.appended
+        self.appended += 1
+
+    def insert(self, order):
+        # adds an order in received_time order, behind any received at the same time
+        later = [o for o in self if o.received_time > order.received_time]
+        for o in later:
+            self.remove(o)
+        self.append(order)
+        for o in later:
+            self.append(o)
+
+    def remove(self, order):
+        del self.orders[order.order_id]
+        del self.position[order.order_id]
+        same_hosp = self.by_hospital[order.hospital]
+        del same_hosp[order.order_id]
+        if not same_hosp:
+            del self.by_hospital[order.hospital]
+
+    def first_at(self, hospital):
+        same_hosp = self.by_hospital.get(hospital)
+        if same_hosp:
+            return next(iter(same_hosp.values()))
+        return None
+
+    def first_of(self, hospitals):
+        firsts = [next(iter(self.by_hospital[h].values())) for h in hospitals]
+        return min(firsts, key=lambda order: self.position[order.order_id], default=None)
+
+    def pop(self):
+        order = next(reversed(self.orders.values()))
+        self.remove(order)
+        return order
+
+    def clear(self):
+        self.orders.clear()
+        self.by_hospital.clear()
+        self.position.clear()
+
+    def __iter__(self):
+        return iter(self.orders.values())
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __getitem__(self, i):
+        return list(self.orders.values())[i]
+
+    def __eq__(self, other):
+        if isinstance(other, (OrderQueue, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "OrderQueue(%r)" % list(self)
+
+
+class Fleet:
+    """
+    Tracks which zips are at base. Idle zips sit in a free pool (a heap of
+    their positions in the zip list, so the first idle zip is always picked)
+    and zips in flight sit in a min-heap keyed on return_time.
+
+    Methods
+    ------
+    update - moves zips that have landed by current_time back to the pool
+    available - number of zips at base
+    dispatch - sends the first idle zip, returns its return_time (or None)
+    next_free_time - time the next zip in flight lands (or None)
+    """
+
+    def __init__(self, zips):
+        self.zips = zips
+        self.free = []
+        self.in_flight = []
+        for i, z in enumerate(zips):
+            if z.return_time > 0:
+                z.at_base = False
+                self.in_flight.append((z.return_time, i))
+            else:
+                self.free.append(i)
+        heapq.heapify(self.free)
+        heapq.heapify(self.in_flight)
+
+    def update(self, current_time):
+        while self.in_flight and self.in_flight[0][0] <= current_time:
+            _, i = heapq.heappop(self.in_flight)
+            self.zips[i].at_base = True
+            heapq.heappush(self.free, i)
+
+    def available(self, current_time):
+        self.update(current_time)
+        return len(self.free)
+
+    def dispatch(self, current_time, dist_to_travel):
+        self.update(current_time)
+        if not self.free:
+            return None
+        i = heapq.heappop(self.free)
+        return_time = self.zips[i].dispatch(current_time, dist_to_travel)
+        heapq.heappush(self.in_flight, (return_time, i))
+        return return_time
+
+    def next_free_time(self, current_time):
+        self.update(current_time)
+        if self.in_flight:
+            return self.in_flight[0][0]
+        return None
+
+
+class PartialRoute:
+    """
+    The orders picked so far for one flight, with the distance from base
+    through every stop to the last one cached. Checking a candidate stop is
+    O(1): the cached path, plus last -> candidate -> base.
+
+    Methods
+    ------
+    append - adds an order, extending the cached path by one leg
+    total - closed route distance, base -> stops -> base
+    with_stop - total if one more hospital (by index) were added
+    with_stops - with_stop for an array of hospital indices at once
+    """
+    __slots__ = ("orders", "path", "last", "dist_matrix", "hosp_index", "base")
+
+    def __init__(self, dist_matrix, hosp_index, base, orders=()):
+        self.dist_matrix = dist_matrix
+        self.hosp_index = hosp_index
+        self.base = base
+        self.orders = []
+        self.path = 0.0
+        self.last = base
+        for order in orders:
+            self.append(order)
+
+    def append(self, order):
+        hosp = self.hosp_index[order["hospital"]]
+        self.path += self.dist_matrix[self.last, hosp]
+        self.last = hosp
+        self.orders.append(order)
+
+    def total(self):
+        return self.path + self.dist_matrix[self.last, self.base]
+
+    def with_stop(self, hosp):
+        return self.path + self.dist_matrix[self.last, hosp] + self.dist_matrix[hosp, self.base]
+
+    def with_stops(self, hosps):
+        return self.path + self.dist_matrix[self.last, hosps] + self.dist_matrix[hosps, self.base]
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __iter__(self):
+        return iter(self.orders)
+
+    def __getitem__(self, i):
+        return self.orders[i]
+
+
+class DistanceMatrix:
+    """
+    Pairwise distances between all hospitals (and base), computed in one
+    vectorized pass over the north/east columns.
+
+    matrix[i, j] is the distance between hospitals with index i and j,
+    index maps hospital name -> row. dists[x][y] still works by name.
+    A precomputed matrix (e.g. from a checkpoint) can be passed in.
+    """
+
+    def __init__(self, hosp_df, matrix=None):
+        self.names = list(hosp_df["hospital_name"])
+        self.index = {name: i for i, name in enumerate(self.names)}
+        if matrix is not None:
+            self.matrix = matrix
+            return
+
+        north = hosp_df["north"].to_numpy(dtype=float)
+        east = hosp_df["east"].to_numpy(dtype=float)
+        d_north = north[:, None] - north[None, :]
+        d_east = east[:, None] - east[None, :]
+        self.matrix = np.sqrt(d_north**2 + d_east**2)
+
+    def __getitem__(self, name):
+        return DistanceRow(self, self.index[name])
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def keys(self):
+        return self.names
+
+
+class DistanceRow:
+    """
+    Read-only view of one row of a DistanceMatrix, indexed by hospital name.
+    """
+
+    def __init__(self, dist_matrix, i):
+        self.dist_matrix = dist_matrix
+        self.row = dist_matrix.matrix[i]
+
+    def __getitem__(self, name):
+        return self.row[self.dist_matrix.index[name]]
+
+    def __contains__(self, name):
+        return name in self.dist_matrix.index
+
+    def __iter__(self):
+        return iter(self.dist_matrix.names)
+
+    def __len__(self):
+        return len(self.row)
+
+    def keys(self):
+        return self.dist_matrix.names
+
+    def items(self):
+        return zip(self.dist_matrix.names, self.row)
+
+
 class ZipScheduler:
     """
-    A class that schedules orders.
+    A class that schedules orders for the zips of one depot, the hosp_df
+    row named base (see depots.py for several depots).
 
     Methods
     ------
-    makedict - makes dict of hospital distances
+    makedict - makes distance matrix of hospitals, indexable by name
     send_zip - sends next zip (if available)
     zips_available - returns number of zips available
+    next_free_time - returns when the next zip in flight gets back to base
+    waiting_on_zip - whether orders are queued but no zip is idle
+    wake_time - next_free_time, if orders are waiting on a zip
     queue_order - queues orders into 2 queues
                   (emergency and resupply) in order of reception
-    q_remove - returns queue without that order (no side effects)
-    hosp_distance - finds dist between two hospitals, used in makedict
+    q_remove - removes orders from a queue, returns the queue
+    hosp_distance - finds dist between two hospitals
     route_distance - given ordered hospitals, return distance of route
+    partial_route - starts a PartialRoute (optionally from some orders)
+    find_in_range - earliest queued order that can join a partial route
     find_next - helper function for schedule_next_flight:
                 finds next order to fulfill
     find_orders - helper function for schedule_next_flight:
                   iterates through both queues
-    schedule_next_flight - schedules flight. Returns orders,
-                           wait_times, flight_time if scheduled.
-                           If no available zips, prints out string telling us
-                           this. Else returns None.
+    plan_route - given a PartialRoute for one flight, returns its orders in
+                 delivery order with the route distance
+    nearby_loads - for each flight, the flights with the closest stops
+    rebalance - moves/swaps orders between nearby flights leaving together
+                to shorten their total distance
+    schedule_next_flight - schedules flight. Returns a FlightResult; its
+                           status says whether it launched, or whether
+                           there was no zip or nothing to fly.
+    schedule_flights - fills every available zip at once, returns a
+                       list of launched FlightResults
 
     """
 
-    def __init__(self, hosp_df, total_zips=10, max_load=3, flight_speed=30, max_range=160000):
+    # orders find_in_range checks one by one before using the hospital index
+    scan_limit = 8
+    # flights each flight is paired with in rebalance, and passes over them
+    rebalance_neighbors = 8
+    rebalance_passes = 3
+
+    def __init__(self, hosp_df, total_zips=10, max_load=3, flight_speed=30, max_range=160000,
+                 dists=None, base="base"):
         self.total_zips = total_zips
         self.max_load = max_load
         self.flight_speed = flight_speed
         self.max_range = max_range
         self.hosp_df = hosp_df
-        self.emergency = []
-        self.resupply = []
-        self.dists = self.makedict(self.hosp_df)
+        self.emergency = OrderQueue()
+        self.resupply = OrderQueue()
+        # id given to the next queued order
+        self.next_order_id = 0
+        # dists can be handed over from a checkpoint instead of recomputed
+        self.dists = self.makedict(self.hosp_df) if dists is None else dists
+        # integer index per hospital name, and the raw matrix for hot paths
+        self.hosp_index = self.dists.index
+        self.dist_matrix = self.dists.matrix
+        # row of the depot this scheduler's zips fly from
+        self.base_name = base
+        self.base = self.hosp_index[base]
 
         # create a list of our 10 zips
-        self.ZipList = [Zip() for i in range(total_zips)]
+        self.ZipList = [Zip(flight_speed) for i in range(total_zips)]
+        self.fleet = Fleet(self.ZipList)
 
     def makedict(self, hosp_df):
-        d = {}
-        for i in range(len(hosp_df)):
-            hi = hosp_df.loc[i]
-            d[hi["hospital_name"]] = {}
-            for j in range(len(hosp_df)):
-                hj = hosp_df.loc[j]
-                d[hi["hospital_name"]][hj["hospital_name"]] = self.hosp_distance(hi["hospital_name"], hj["hospital_name"])
-        return d
+        return DistanceMatrix(hosp_df)
 
 
     def send_zip(self, current_time, dist_to_travel):
-        for z in self.ZipList:
-            z.update_status(current_time)
-        available_zip = next((z for z in self.ZipList if z.at_base), None)
-        if available_zip:
-            return available_zip.dispatch(current_time, dist_to_travel)
-        else:
-            return None
+        return self.fleet.dispatch(current_time, dist_to_travel)
 
     def zips_available(self, current_time):
-        for z in self.ZipList:
-            z.update_status(current_time)
-        return len([z for z in self.ZipList if z.at_base])
+        return self.fleet.available(current_time)
 
-    def queue_order(self, received_time, hospital, priority):
-        priority = priority.strip()
-        if priority == 'Emergency':
-            self.emergency.append({"received_time": received_time,
-                                       "hospital": hospital.strip(),
-                                       "priority": priority})
-        elif priority == 'Resupply':
-            self.resupply.append({"received_time": received_time,
-                                      "hospital": hospital.strip(),
-                                      "priority": priority})
+    def next_free_time(self, current_time):
+        return self.fleet.next_free_time(current_time)
 
-    def q_remove(self, queue, *args):
-        return [x for x in queue if x not in args]
+    def waiting_on_zip(self, current_time):
+        # orders are queued but every zip is out
+        return bool(self.emergency or self.resupply) and not self.zips_available(current_time)
 
-    def hosp_distance(self, x, y):
-        # distance between hospitals named x and y
+    def wake_time(self, current_time):
+        # when a zip lands for the orders waiting now, None if nothing is waiting on one
+        if self.waiting_on_zip(current_time):
+            return self.next_free_time(current_time)
+        return None
 
-        def find_coord(coord, direction):
-            return hosp_df.loc[hosp_df["hospital_name"] == coord, direction]
+    def queue_order(self, received_time, hospital, priority, order_id=None):
+        priority = priority.strip()
+        if priority == Priority.EMERGENCY:
+            queue = self.emergency
+        elif priority == Priority.RESUPPLY:
+            queue = self.resupply
+        else:
+            return
 
-        north_x = find_coord(x, "north")
-        east_x = find_coord(x, "east")
-        north_y = find_coord(y, "north")
-        east_y = find_coord(y, "east")
+        hospital_id = self.hosp_index[hospital.strip()]
+        if order_id is None:
+            order_id = self.next_order_id
+            self.next_order_id += 1
+        queue.append(Order(order_id, received_time, self.dists.names[hospital_id],
+                           hospital_id, Priority(priority)))
 
-        return np.sqrt((int(north_x) - int(north_y))**2 + (int(east_x) - int(east_y))**2)
+    def q_remove(self, queue, *args):
+        for order in args:
+            queue.remove(order)
+        return queue
 
+    def hosp_distance(self, x, y):
+        # distance between hospitals named x and y
+        return self.dist_matrix[self.hosp_index[x], self.hosp_index[y]]
 
     def route_distance(self, *args):
+        m = self.dist_matrix
+        idx = [self.hosp_index[order["hospital"]] for order in args]
+
         # find distance to go back to base from either end
-        dist = self.dists["base"][args[0]["hospital"]] + self.dists["base"][args[-1]["hospital"]]
+        dist = m[self.base, idx[0]] + m[self.base, idx[-1]]
 
         # find distance between points
-        for i in range(len(args) - 1):
-            dist += self.dists[args[i]["hospital"]][args[i+1]["hospital"]]
+        for i in range(len(idx) - 1):
+            dist += m[idx[i], idx[i+1]]
         return dist
 
-    def find_next(self, queue, *args):
-        if args:
+    def partial_route(self, *orders):
+        return PartialRoute(self.dist_matrix, self.hosp_index, self.base, orders)
+
+    def find_next(self, queue, route):
+        if not queue:
+            return None, queue
+
+        if route:
             # try to find a next order that goes to the same hospital as the last order
-            same_hosp = next((order for order in queue
-                              if order["hospital"] == args[-1]["hospital"]), None)
+            same_hosp = queue.first_at(route[-1]["hospital"])
             if same_hosp:
                 new_queue = self.q_remove(queue, same_hosp)
                 return same_hosp, new_queue
 
         # else find next order in given queue that is within flight range, else returns None
-        close_hosp = next((order for order in queue
-                          if self.route_distance(*args, order) < self.max_range), None)
+        close_hosp = self.find_in_range(queue, route)
         if close_hosp:
             new_queue = self.q_remove(queue, close_hosp)
             return close_hosp, new_queue
         return None, queue
 
+    def find_in_range(self, queue, route):
+        # the head of the queue usually fits, so try a few orders directly
+        for order in islice(queue, self.scan_limit):
+            if route.with_stop(order.hospital_id) < self.max_range:
+                return order
+        if len(queue) <= self.scan_limit:
+            return None
+
+        # else check each queued hospital once (not each order), then take the
+        # earliest order among those that fit, same as scanning in queue order
+        names = list(queue.by_hospital)
+        hosps = np.fromiter((self.hosp_index[h] for h in names), dtype=np.intp, count=len(names))
+        in_range = route.with_stops(hosps) < self.max_range
+        return queue.first_of([names[i] for i in np.flatnonzero(in_range)])
 
     def find_orders(self):
-        orders = []
+        route = self.partial_route()
         if self.emergency:
-            while len(orders) < self.max_load:
-                order, new_queue = self.find_next(self.emergency, *orders)
+            while len(route) < self.max_load:
+                order, new_queue = self.find_next(self.emergency, route)
                 if order:
                     self.emergency = new_queue
-                    orders.append(order)
+                    route.append(order)
                 else:
                     break
 
-            while len(orders) < self.max_load:
-                r_order, new_queue = self.find_next(self.resupply, *orders)
+            while len(route) < self.max_load:
+                r_order, new_queue = self.find_next(self.resupply, route)
                 if r_order:
                     self.resupply = new_queue
-                    orders.append(r_order)
+                    route.append(r_order)
                 else:
                     break
 
         elif self.resupply:
-            while len(orders) < self.max_load:
-                r_order, new_queue = self.find_next(self.resupply, *orders)
+            while len(route) < self.max_load:
+                r_order, new_queue = self.find_next(self.resupply, route)
                 if r_order:
                     self.resupply = new_queue
-                    orders.append(r_order)
+                    route.append(r_order)
                 else:
                     break
 
         else:
             return None
-        return orders
+        return route
+
+    def plan_route(self, route):
+        # orders are flown in the order they were picked
+        return list(route), route.total()
+
+    def launch(self, current_time, route):
+        # plan and send one flight
+        orders, dist_to_travel = self.plan_route(route)
+        wait_times = [WaitRecord(order.priority, current_time - order.received_time)
+                      for order in orders]
+
+        # find next available zip, deploy if available
+        return_time = self.send_zip(current_time, dist_to_travel)
+        if return_time is None:
+            return NO_ZIP
+        return FlightResult(orders, wait_times, return_time - current_time, FlightStatus.LAUNCHED)
 
     def schedule_next_flight(self, current_time):
         # first order will be first in line by default
@@ -201,20 +678,103 @@ class ZipScheduler:
             orders = self.find_orders()
 
             if orders:
-                dist_to_travel = self.route_distance(*orders)
-                wait_times = [{"priority": order["priority"],
-                               "wait": (current_time - order["received_time"])}
-                               for order in orders]
-
-                # find next available zip, deploy if available
-                return_time = self.send_zip(current_time, dist_to_travel)
-                if return_time:
-                    flight_time = return_time - current_time
-                    return orders, wait_times, flight_time
-                else:
-                    return "No available zips right now, please wait"
+                return self.launch(current_time, orders)
             else:
-                return None
+                return NO_ORDERS
 
         else:
-            return "No available zips right now, please wait"
+            return NO_ZIP
+
+    def improve_pair(self, a, b, dist_a, dist_b):
+        # best single move (a -> b) or swap between two flights, or None.
+        # a and b are in delivery order, so candidates are scored from the
+        # cached totals by changing only the legs next to the moved stops;
+        # only the winner is planned in full
+        m = self.dist_matrix
+        base = self.base
+        stops_a = [base] + [order.hospital_id for order in a] + [base]
+        stops_b = [base] + [order.hospital_id for order in b] + [base]
+        best = None
+        best_total = dist_a + dist_b - 1e-9
+        for i, order in enumerate(a):
+            before_a, h, after_a = stops_a[i], stops_a[i+1], stops_a[i+2]
+            without = dist_a - m[before_a, h] - m[h, after_a]
+
+            # swap with each order on b
+            for k, other in enumerate(b):
+                before_b, g, after_b = stops_b[k], stops_b[k+1], stops_b[k+2]
+                new_dist_a = without + m[before_a, g] + m[g, after_a]
+                new_dist_b = (dist_b - m[before_b, g] - m[g, after_b]
+                              + m[before_b, h] + m[h, after_b])
+                if (new_dist_a < self.max_range and new_dist_b < self.max_range
+                        and new_dist_a + new_dist_b < best_total):
+                    best = (a[:i] + [other] + a[i+1:], b[:k] + [order] + b[k+1:])
+                    best_total = new_dist_a + new_dist_b
+
+            # move to the end of b
+            if len(a) > 1 and len(b) < self.max_load:
+                last = stops_b[-2]
+                new_dist_a = without + m[before_a, after_a]
+                new_dist_b = dist_b - m[last, base] + m[last, h] + m[h, base]
+                if (new_dist_a < self.max_range and new_dist_b < self.max_range
+                        and new_dist_a + new_dist_b < best_total):
+                    best = (a[:i] + a[i+1:], b + [order])
+                    best_total = new_dist_a + new_dist_b
+
+        if best is None:
+            return None
+        # planning can only shorten a route, but check for rounding
+        new_a, new_dist_a = self.plan_route(self.partial_route(*best[0]))
+        new_b, new_dist_b = self.plan_route(self.partial_route(*best[1]))
+        if (new_dist_a < self.max_range and new_dist_b < self.max_range
+                and new_dist_a + new_dist_b < dist_a + dist_b - 1e-9):
+            return new_a, new_b, new_dist_a, new_dist_b
+        return None
+
+    def nearby_loads(self, loads):
+        # for each load, the rebalance_neighbors other loads with the closest stops
+        n = len(loads)
+        if n <= self.rebalance_neighbors + 1:
+            return [[b for b in range(n) if b != a] for a in range(n)]
+        stops = np.fromiter((order.hospital_id for orders in loads for order in orders),
+                            dtype=np.intp)
+        starts = np.cumsum([0] + [len(orders) for orders in loads[:-1]])
+        closest = np.minimum.reduceat(self.dist_matrix[np.ix_(stops, stops)], starts, axis=0)
+        closest = np.minimum.reduceat(closest, starts, axis=1)
+        np.fill_diagonal(closest, np.inf)
+        return np.argsort(closest, axis=1, kind="stable")[:, :self.rebalance_neighbors].tolist()
+
+    def rebalance(self, loads):
+        planned = [self.plan_route(self.partial_route(*orders)) for orders in loads]
+        loads = [orders for orders, _ in planned]
+        dists = [dist for _, dist in planned]
+        partners = self.nearby_loads(loads)
+        for _ in range(self.rebalance_passes):
+            improved = False
+            for a, near in enumerate(partners):
+                for b in near:
+                    better = self.improve_pair(loads[a], loads[b], dists[a], dists[b])
+                    if better:
+                        loads[a], loads[b], dists[a], dists[b] = better
+                        improved = True
+            if not improved:
+                break
+        return loads
+
+    def schedule_flights(self, current_time):
+        """
+        Fills every available zip in one pass. Loads are picked one zip at
+        a time with find_orders (so emergencies still go first), then
+        rebalanced across the flights before they all leave.
+        """
+        loads = []
+        for _ in range(self.zips_available(current_time)):
+            orders = self.find_orders()
+            if not orders:
+                break
+            loads.append(list(orders))
+
+        flights = []
+        for orders in self.rebalance(loads):
+            flights.append(self.launch(current_time, self.partial_route(*orders)))
+        return flights